@@ -1,13 +1,28 @@
 import sublime, sublime_plugin
+import os
 import time
 import sys
 import re
+import site
+import mmap
+import json
+import array
+import struct
+import hashlib
+import bisect
+import itertools
+import heapq
 import functools
+import contextlib
+import collections
+import multiprocessing
+import concurrent.futures
 
 import pushdown
 import threading
 
 from debug_tools import getLogger
+from .HighlightWordsScanner import Regions, Matcher, TimeBudgetExceeded, ScanCancelled, regions_before, scan_text, scan_until, search_until, search_window
 
 SCOPES = ['string', 'entity.name.class', 'variable.parameter', 'invalid.deprecated', 'invalid', 'support.function']
 
@@ -18,8 +33,35 @@ WHOLE_WORD = False # only effective when USE_REGEX is True
 UNDER_THE_CURSOR = True
 CLEAR_ON_ESCAPE = False
 FILE_SIZE_LIMIT = 4194304
+LAZY_CHUNK_SIZE = 262144
+LAZY_PUBLISH_INTERVAL = 0.5
+INCREMENTAL_MARGIN = 1024
+TIMINGS_SAMPLES = 100
+HIGHLIGHT_ALL_VIEWS = False
+BACKGROUND_WORKERS = 2
+DISK_CACHE_SIZE = 0
+DISK_CACHE_VERIFY_DELAY = 2
+RESULTS_PAGE_SIZE = 1000
+RESULTS_CONTEXT_SIZE = 80
+PARALLEL_SCAN_SIZE = 0
+PARALLEL_SCAN_PROCESSES = 0
+PARALLEL_SCAN_PYTHON = ""
+REGEX_TIME_BUDGET = 1.0
+HIGHLIGHT_TEXT_SAVE_INTERVAL = 5
+SHOW_MATCH_COUNTS = True
+OVERVIEW_BUCKETS = 0
+TERM_REGION_BUDGET = 50000
+TOTAL_REGION_BUDGET = 200000
+VIEWPORT_MARGIN = 2
+VIEWPORT_POLL_INTERVAL = 0.25
+OVERVIEW_SCOPES = ['region.bluish', 'region.yellowish', 'region.redish']
+HIGHLIGHT_CAPTURED_OCCURRENCES = False
+REGEX_KILL_DELAY = 1
 SETTINGS = {}
+SETTINGS_KEY = None
 KEYWORD_MAP = []
+KEYWORD_TERMS = []
+KEYWORDS_KEY = None
 
 
 # Debugger settings: 0 - disabled, 127 - enabled
@@ -36,19 +78,379 @@ SPACES: /[\t \f]+/
 """, start='start', parser='lalr', lexer='contextual' )
 
 g_view_selections = {}
+g_buffer_results = {}
+g_text_snapshots = {}
 g_regionkey = "HighlightWords"
 
+g_process_pool = None
+g_process_pool_lock = threading.Lock()
+g_process_pool_workers = 0
+g_process_pool_processes = []
+g_status_key = "highlight_words"
+g_slow_status_key = "highlight_words_slow"
+g_overview_key = "highlight_words_overview"
+
+class Timings(object):
+    """
+    The rolling durations in seconds of each step of the highlighting on a view, keeping the last
+    `TIMINGS_SAMPLES` of each one, with a report of their histograms for the timings command.
+    """
+    buckets = ( 0.001, 0.004, 0.016, 0.064, 0.256, 1.024 )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = collections.OrderedDict()
+
+    def add(self, step, seconds):
+        with self.lock:
+            samples = self.samples.get( step )
+
+            if samples is None or samples.maxlen != TIMINGS_SAMPLES:
+                samples = self.samples[step] = collections.deque( samples or (), TIMINGS_SAMPLES )
+
+            samples.append( seconds )
+
+    @contextlib.contextmanager
+    def measure(self, step):
+        start_time = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.add( step, time.perf_counter() - start_time )
+
+    def iterate(self, step, iterable):
+        """ Yield the `iterable` items, measuring how long each one took to be produced """
+        iterator = iter( iterable )
+
+        while True:
+            with self.measure( step ):
+                item = next( iterator, self )
+
+            if item is self: return
+            yield item
+
+    def last(self, step, default=0):
+        with self.lock:
+            samples = self.samples.get( step )
+            return samples[-1] if samples else default
+
+    def histogram(self, samples):
+        counts = [ 0 ] * ( len( self.buckets ) + 1 )
+
+        for seconds in samples:
+            counts[bisect.bisect_right( self.buckets, seconds )] += 1
+
+        return counts
+
+    def report(self):
+        with self.lock:
+            steps = [ ( step, sorted( samples ) ) for step, samples in self.samples.items() ]
+
+        limits = [ '<%g' % ( bucket * 1000 ) for bucket in self.buckets ] + [ '>=%g' % ( self.buckets[-1] * 1000 ) ]
+        lines = [ '%-12s %6s %9s %9s %9s %9s   %s' % ( 'step', 'count', 'mean', 'p50', 'p95', 'max',
+                ' '.join( '%6s' % limit for limit in limits ) ) ]
+
+        for step, samples in steps:
+            count = len( samples )
+            lines.append( '%-12s %6d %9.3f %9.3f %9.3f %9.3f   %s' % ( step, count,
+                    sum( samples ) * 1000 / count,
+                    samples[count // 2] * 1000,
+                    samples[min( count - 1, count * 95 // 100 )] * 1000,
+                    samples[-1] * 1000,
+                    ' '.join( '%6d' % bucket for bucket in self.histogram( samples ) ) ) )
+
+        return '\n'.join( lines )
+
+
+class TextSnapshot(object):
+    """
+    The text of a buffer at one change count, shared by all its views and passes until it changes.
+    It is only read when a scan needs it, through the `view` requesting it, as the one which took
+    the snapshot may have been closed since, e.g., a clone of it.
+    """
+
+    def __init__(self, view, change_count):
+        self.change_count = change_count
+        self.size = view.size()
+        self.lock = threading.Lock()
+        self._text = None
+
+    def text(self, view):
+        """ Return the text up to `FILE_SIZE_LIMIT`, reading it on the first call """
+        with self.lock:
+
+            if self._text is None:
+                self._text = view.substr( sublime.Region( 0, min( self.size, FILE_SIZE_LIMIT ) ) )
+
+            return self._text
+
+
+def get_text_snapshot(view):
+    """ Return the text snapshot of the view buffer at its current change count """
+    buffer_id = view.buffer_id()
+    change_count = view.change_count()
+    snapshot = g_text_snapshots.get( buffer_id )
+
+    if snapshot is None or snapshot.change_count != change_count:
+        snapshot = g_text_snapshots[buffer_id] = TextSnapshot( view, change_count )
+
+    return snapshot
+
+
+class ChunkedSearch(object):
+    """
+    A `/regex/` search of a buffer larger than `FILE_SIZE_LIMIT`, done chunk by chunk along its lazy
+    scan, see `search_chunks()`. The matches of the chunks are joined in their order, skipping the
+    ends of a match which crossed into the next chunk.
+    """
+
+    def __init__(self, regex, pattern):
+        self.regex = regex
+        self.pattern = pattern
+        self.chunks = {}
+        self.entries = {}
+        self.spent = 0
+        self.failed = False
+
+    def matches(self):
+        """ Return the matches of the chunks searched so far """
+        matches = []
+
+        for index in sorted( self.chunks ):
+            last_end = matches[-1].span()[1] if matches else 0
+            matches.extend( itertools.dropwhile( lambda match: match.span()[0] < last_end, self.chunks[index] ) )
+
+        return matches
+
+    def get_entries(self, get_entries):
+        """
+        Return the `(identity, regions)` of the matches of the chunks searched so far, computing the
+        ones of each chunk once with `get_entries()`, unless the matches skipped at its start change
+        """
+        if self.failed: return []
+
+        joined = {}
+        last_end = 0
+
+        for index in sorted( self.chunks ):
+            matches = self.chunks[index]
+            skipped = 0
+
+            while skipped < len( matches ) and matches[skipped].span()[0] < last_end:
+                skipped += 1
+
+            cached = self.entries.get( index )
+            if cached is None or cached[0] != skipped:
+                cached = self.entries[index] = ( skipped, get_entries( [ matches[skipped:] ] ) )
+
+            for identity, regions in cached[1]:
+                joined.setdefault( identity, [] ).append( regions )
+
+            if skipped < len( matches ):
+                last_end = matches[-1].span()[1]
+
+        return [ ( identity, join_regions( regions_list ) ) for identity, regions_list in joined.items() ]
+
+
 class Data(object):
 
     def __init__(self, view):
         self.view = view
-        self.added_regions = []
-        self.added_regions_set = []
+        self.added_regions = Regions()
+        self.key_regions = {}
+        self.navigation = ( self.key_regions, self.added_regions )
         self.last_caret_begin = 0
         self.selected_region_index = 0
 
-    def add_regions_set(self, regions_set):
-        self.added_regions = list( sorted( regions_set, key=lambda item: item[0] ) )
+        # the text snapshot the cached `term_regions` were computed from
+        self.text = None
+        self.changed = None
+        self.term_regions = {}
+        self.results_keys = {}
+        self.scheduler = Scheduler()
+        self.timings = Timings()
+
+        # the keys of the matchers and `(source, flags)` of the searches which did not finish on their
+        # time budget, skipped while they are on the query, and of the matchers which found it spent
+        # by the ones before them, scanned first on the next pass
+        self.slow_keys = set()
+        self.slow_searches = set()
+        self.deferred_keys = set()
+
+        # the `(pool, future)` of the regex matchers `submit_scans()` started on the process pool
+        self.submitted = {}
+
+        # the `(regions, scope)` last added for each key, or None when it was erased
+        self.drawn = {}
+        self.capped = {}
+        self.render_window = None
+        self.word_slots = {}
+        self.lock = threading.Lock()
+
+    def record_change(self, begin, old_end, new_end):
+        """ Merge the replacement of `begin:old_end` by `begin:new_end` into the pending changes """
+
+        if self.changed is None:
+            self.changed = ( begin, old_end, new_end )
+            return
+
+        changed_begin, changed_old_end, changed_new_end = self.changed
+        union_end = max( changed_new_end, old_end )
+
+        self.changed = (
+                min( changed_begin, begin ),
+                union_end - ( changed_new_end - changed_old_end ),
+                union_end + ( new_end - old_end )
+            )
+
+    def reset_text(self):
+        self.text = None
+        self.changed = None
+        self.term_regions = {}
+        self.slow_keys = set()
+        self.deferred_keys = set()
+
+    def update_text(self, text):
+        """
+        Bring the cached `term_regions` up to date with the new buffer `text`. Only the matchers whose
+        matches are shorter than `INCREMENTAL_MARGIN` are scanned again around the changes, the others
+        are forgotten, to be scanned again in full by `find_regions()`.
+        """
+        changed, self.changed = self.changed, None
+        old_text, self.text = self.text, text
+
+        if old_text is None or old_text == text:
+            return
+
+        if changed is None or changed[1] > len( old_text ) or len( text ) - len( old_text ) != changed[2] - changed[1]:
+            changed = text_changes( old_text, text )
+
+        for key, (matcher, regions) in list( self.term_regions.items() ):
+
+            if is_bounded( matcher ):
+                self.term_regions[key] = ( matcher, rescan_regions( matcher, text, regions, *changed ) )
+
+            else:
+                del self.term_regions[key]
+
+    def find_regions(self, matcher, cancelled=None, deadline=None):
+        """
+        Raise TimeBudgetExceeded when a regex `matcher` does not finish before the pass `deadline`,
+        right away on the next passes when it took most of the time budget by itself, instead of
+        spending it again, until the matcher leaves the query. Raise ScanCancelled when `cancelled()`.
+        """
+        if matcher.key in self.slow_keys:
+            raise TimeBudgetExceeded()
+
+        cached = self.term_regions.get( matcher.key )
+
+        if cached is None:
+
+            if matcher.is_literal:
+                regions = parallel_scan( matcher, self.text ) if 0 < PARALLEL_SCAN_SIZE <= len( self.text ) else None
+                regions = Regions( matcher.finditer( self.text ) ) if regions is None else regions
+
+            else:
+                started = time.time()
+
+                try:
+                    regions = run_bounded( scan_until, matcher, self.text, deadline=deadline, cancelled=cancelled,
+                            submitted=self.submitted.pop( matcher.key, None ) )
+
+                except TimeBudgetExceeded:
+                    ( self.slow_keys if is_slow( started ) else self.deferred_keys ).add( matcher.key )
+                    raise
+
+                self.deferred_keys.discard( matcher.key )
+
+            cached = ( matcher, regions )
+            self.term_regions[matcher.key] = cached
+
+        return cached[1]
+
+    def submit_scans(self, matchers, deadline):
+        """
+        Start the regex `matchers` which `find_regions()` will scan on the process pool, so they run
+        in parallel instead of one after the other, the ones deferred by the last pass first
+        """
+        for pool, future in self.submitted.values():
+            future.cancel()
+
+        self.submitted = {}
+
+        for matcher in sorted( matchers, key=lambda matcher: matcher.key not in self.deferred_keys ):
+
+            if matcher.is_literal or matcher.key in self.slow_keys or matcher.key in self.term_regions:
+                continue
+
+            submitted = submit_bounded( scan_until, matcher, self.text, deadline=deadline )
+            if submitted is None: break
+
+            self.submitted[matcher.key] = submitted
+
+    def retain_regions(self, matchers):
+        """ Forget the regions and slow keys of the terms not scanned by `matchers`, or by their `split()` """
+        keys = set( matcher.key for matcher in matchers )
+        keys.update( ( item, ) for matcher in matchers for item in matcher.key )
+
+        for key in list( self.term_regions ):
+            if key not in keys:
+                del self.term_regions[key]
+
+        self.slow_keys &= keys
+        self.deferred_keys &= keys
+
+    def index_regions(self, drawn):
+        """
+        Return the `(key_regions, added_regions)` navigation index of the `(key, regions, scope)` drawn,
+        which `set_regions()` publishes, computed on the worker thread. The sorted regions of each key
+        are merged into it, only the keys added since the last index when no other changed.
+        """
+        key_regions = dict( ( key, regions ) for key, regions, scope in drawn )
+        old_key_regions, old_added_regions = self.navigation
+
+        if any( key_regions.get( key ) != regions for key, regions in old_key_regions.items() ):
+            added_regions = merge_regions( list( key_regions.values() ) )
+
+        else:
+            added_keys = [ key for key in key_regions if key not in old_key_regions ]
+            added_regions = merge_regions( [ old_added_regions ] + [ key_regions[key] for key in added_keys ] )
+
+        self.navigation = ( key_regions, added_regions )
+        return self.navigation
+
+    def set_regions(self, navigation):
+        """ Publish the `(key_regions, added_regions)` of `index_regions()` as the navigation index """
+        self.key_regions, self.added_regions = navigation
+
+    def assign_slots(self, identities):
+        """
+        Return the highlight key index of each word identity, keeping the ones the words had on the
+        last pass, so adding or removing a word does not change the keys and colors of the others.
+        """
+        old_slots = self.word_slots
+        slots = dict( ( identity, old_slots[identity] ) for identity in identities if identity in old_slots )
+
+        used = set( slots.values() )
+        free = ( slot for slot in itertools.count() if slot not in used )
+
+        for identity in identities:
+            if identity not in slots:
+                slots[identity] = next( free )
+
+        self.word_slots = slots
+        return [ slots[identity] for identity in identities ]
+
+    def contains(self, region):
+        index = self.added_regions.find( region[0] )
+
+        while index < len( self.added_regions ) and self.added_regions.begins[index] == region[0]:
+            if self.added_regions.ends[index] == region[1]: return True
+            index += 1
+
+        return False
 
     def actual_caret_begin(self):
         selections = self.view.sel()
@@ -59,393 +461,1558 @@ class Data(object):
 
         return target_position
 
-    def _reset_counter(self, backwards):
+    def target_points(self, backwards=False):
+        actual_caret_begin = self.actual_caret_begin()
+        has_selection_changed = actual_caret_begin != self.last_caret_begin
+
+        if has_selection_changed:
+            # the first region starting after the caret, or the last one before it
+            self.selected_region_index = self.added_regions.find( actual_caret_begin )
 
-        if backwards:
-            self.selected_region_index = len( self.added_regions ) - 1
+            if backwards:
+                self.selected_region_index -= 1
 
         else:
-            self.selected_region_index = 0
+            self.selected_region_index += -1 if backwards else 1
 
-    @staticmethod
-    def _compare(backwards, first, second):
+        self.selected_region_index %= len( self.added_regions )
+        self.last_caret_begin = actual_caret_begin
+        return self.added_regions[self.selected_region_index]
 
-        if backwards:
-            return first < second
 
-        return first >= second
+@functools.lru_cache( maxsize=128 )
+def parse_query(text, use_regex, ignore_case, whole_word):
+    """
+    Parse the highlight query `text` into its `/regex/` searches, as `(regex, pattern)` pairs,
+    followed by its words, or return None when it is not valid. The results are cached by the
+    query and the settings, use `parse_query.cache_info()` to see the cache hits and misses.
+    """
+    if not use_regex:
+        return tuple( text.split() )
 
-    def target_points(self, backwards=False):
-        increment_size = -1 if backwards else 1
-        actual_caret_begin = self.actual_caret_begin()
-        has_selection_changed = actual_caret_begin != self.last_caret_begin
+    try:
+        searches = []
+        unfiltered_words = []
+        tree = _parser.parse(text)
 
-        if has_selection_changed:
-            has_reached_end = 0
-            has_incremented = False
-            has_decremented = False
+        for token in tree.children:
+            # print( 'token', token.pretty() )
+            if token.type == 'SEARCH':
+                regex = token.strip(' ')
+                searches.append( ( regex, re.compile( regex.strip('/') ) ) )
 
-            while True:
+            elif token.type == 'WORDS':
+                unfiltered_words.append(token)
 
-                try:
-                    target_points = self.added_regions[self.selected_region_index]
+        other_words = list( filter( lambda x: x and x != ' ', re.split( r'((?:\\ |[^ ])+)', " ".join( unfiltered_words ) ) ) )
+        return tuple( searches + other_words )
+
+    except Exception as e:
+        log( "regex message:", e )
+        return None
+
+
+@functools.lru_cache( maxsize=1024 )
+def get_query_terms(text, use_regex, ignore_case, whole_word):
+    """ Return the words and `/regex/` searches sources of the highlight query `text` """
+    query = parse_query( text, use_regex, ignore_case, whole_word )
+
+    if query is None:
+        return tuple( text.split() )
+
+    return tuple( word[0] if isinstance( word, tuple ) else word for word in query )
+
+
+@functools.lru_cache( maxsize=1024 )
+def merge_query(application, window, view, use_regex, ignore_case, whole_word):
+    """
+    Return the window highlight query, merging the application and window level ones, and it
+    merged with the view level one, without repeating their terms. The terms of each level are
+    cached by its text, and the merge by all of them, so a view query is only built again after
+    the settings of one of its levels change.
+    """
+    merged = []
+    terms = set()
+    queries = []
+
+    for text in ( application, window, view ):
+        for term in get_query_terms( text, use_regex, ignore_case, whole_word ):
+            if term not in terms:
+                terms.add( term )
+                merged.append( term )
+
+        # the regex searches must come before the words
+        if use_regex:
+            merged.sort( key=lambda term: not term.startswith( '/' ) )
+
+        queries.append( ' '.join( merged ) )
+
+    return queries[1], queries[2]
+
+
+@functools.lru_cache( maxsize=1024 )
+def term_pattern(word, flag):
+    """ Compile the python equivalent of `view.find_all( word, flag )`, or None when not possible """
+    source = re.escape( word ) if flag & sublime.LITERAL else word
+
+    # posix classes are valid on python, but with a different meaning
+    if '[:' in source:
+        return None
+
+    try:
+        return re.compile( source, re.MULTILINE | ( re.IGNORECASE if flag & sublime.IGNORECASE else 0 ) )
+
+    except Exception as error:
+        log( "regex message:", error )
+        return None
+
+
+def text_changes(old_text, new_text, step=4096):
+    """ Find the `(begin, old_end, new_end)` range where `new_text` differs from `old_text` """
+    limit = min( len( old_text ), len( new_text ) )
+    begin = 0
+
+    while begin < limit:
+        end = min( begin + step, limit )
+
+        if old_text[begin:end] != new_text[begin:end]:
+            while old_text[begin] == new_text[begin]: begin += 1
+            break
+
+        begin = end
+
+    limit -= begin
+    suffix = 0
+
+    while suffix < limit:
+        size = min( step, limit - suffix )
+
+        if old_text[len( old_text ) - suffix - size:len( old_text ) - suffix] != \
+                new_text[len( new_text ) - suffix - size:len( new_text ) - suffix]:
+            while old_text[len( old_text ) - suffix - 1] == new_text[len( new_text ) - suffix - 1]: suffix += 1
+            break
 
-                    if self._compare( backwards, target_points[0], actual_caret_begin ):
-                        has_incremented = True
-                        if has_decremented: break
-                        self.selected_region_index -= increment_size
+        suffix += size
 
-                    else:
-                        has_decremented = True
-                        if has_incremented: break
-                        self.selected_region_index += increment_size
+    return begin, len( old_text ) - suffix, len( new_text ) - suffix
 
-                except IndexError:
-                    has_reached_end += 1
-                    self._reset_counter( backwards )
 
-                if has_reached_end > 1:
-                    break
+def rescan_regions(matcher, text, regions, begin, old_end, new_end):
+    """
+    Update the sorted `regions` matched by `matcher` before the text between `begin` and `old_end`
+    was replaced by the one between `begin` and `new_end`. Only the dirty lines plus a safety
+    margin are scanned again, until the new matches resynchronize with the old ones, which are
+    then shifted and spliced back, giving the same results as a full `find_all()` when no match
+    is longer than the margin, e.g., for the literal words.
+    """
+    delta = new_end - old_end
+    start = text.rfind( '\n', 0, max( 0, begin - INCREMENTAL_MARGIN ) ) + 1
+    limit = text.find( '\n', new_end + INCREMENTAL_MARGIN ) + 1 or len( text )
+
+    # restart outside any old match, so the scan resumes from the same state as before
+    head = regions.find( start )
+
+    if head and regions.ends[head - 1] > start:
+        head -= 1
+        start = regions.begins[head]
+
+    found = regions.slice( 0, head )
+    found.extend( splice_regions( matcher, text, 0, start, limit, regions, regions.find( old_end, head ), delta ) )
+    return found
+
+
+def splice_regions(matcher, text, offset, start, limit, regions, index, delta=0, complete=True):
+    """
+    Scan the `text`, which begins at the buffer `offset`, from `start` until a position after
+    `limit` where neither this scan nor the one which found the sorted `regions` (shifted by
+    `delta`) are inside a match, so both agree from there on. Return the new matches followed by
+    the `regions` after that position. When the `text` ends first, return only the new matches if
+    it is `complete`, i.e., goes until the end of the buffer, otherwise None.
+    """
+    found = Regions()
+    resume = start
+
+    for begin, end, term in matcher.finditer( text, start, offset ):
+        point = max( resume, limit )
+
+        if point <= begin:
+            position = regions.find( point - delta, index )
+
+            if position == index or regions.ends[position - 1] + delta <= begin:
+                found.extend( regions.slice( position, None, delta ) )
+                return found
+
+        found.append( begin, end, term )
+        resume = end
+
+    return found if complete else None
+
+
+def scan_chunks(view, matchers, cancelled, search=None):
+    """
+    Scan the buffer by chunks of `LAZY_CHUNK_SIZE` characters, starting by the visible ones, and
+    yield the regions found so far by each matcher as soon as the visible region is done, then
+    from time to time while the remaining chunks are scanned, the nearest to the viewport first.
+    The `search( index )` callback runs after each chunk is scanned, for the `/regex/` searches.
+    """
+    size = view.size()
+    count = max( 1, -( -size // LAZY_CHUNK_SIZE ) )
+
+    chunks = {}
+    starts = {}
+    published = 0
+
+    # the matchers which may find matches longer than the margin around the chunks scan the whole text
+    text = None if all( is_bounded( matcher ) for matcher in matchers ) else view.substr( sublime.Region( 0, size ) )
+    ahead = {}
+
+    while len( chunks ) < count:
+        if cancelled(): return
+
+        # the view may have been scrolled since the last chunk
+        visible = view.visible_region()
+        first = min( visible.begin() // LAZY_CHUNK_SIZE, count - 1 )
+        last = min( visible.end() // LAZY_CHUNK_SIZE, count - 1 )
+        visible_chunks = [ index for index in range( first, last + 1 ) if index not in chunks ]
+
+        if visible_chunks:
+            index = visible_chunks[0]
 
         else:
-            self.selected_region_index += increment_size
+            index = min( ( index for index in range( count ) if index not in chunks ), key=lambda index: abs( index - first ) )
 
-            try:
-                target_points = self.added_regions[self.selected_region_index]
+        chunks[index] = scan_chunk( view, matchers, chunks, starts, index, size, text, ahead )
+        fix_following_chunks( view, matchers, chunks, starts, index, size, text )
+        if search is not None: search( index )
 
-            except IndexError:
-                self._reset_counter( backwards )
-                target_points = self.added_regions[self.selected_region_index]
+        if len( visible_chunks ) == 1 or len( chunks ) == count or time.time() - published > LAZY_PUBLISH_INTERVAL:
+            published = time.time()
+            matcher_regions = [ Regions() for matcher in matchers ]
 
-        self.last_caret_begin = actual_caret_begin
-        return target_points
+            for index in sorted( chunks ):
+                for regions, chunk_regions in zip( matcher_regions, chunks[index] ):
+                    regions.extend( chunk_regions )
 
+            yield matcher_regions
 
-def State(view):
 
-    if view.id() in g_view_selections:
-        return view, g_view_selections.get( view.id() )
+def scan_chunk(view, matchers, chunks, starts, index, size, whole_text, ahead):
+    """
+    Return the regions each matcher found starting inside the chunk `index`, resuming after the
+    last match of the already scanned `chunks` before it, which may cross its border. The position
+    each scan resumed from is kept on `starts`. The matchers which are not `is_bounded()` scan the
+    `whole_text` instead of the chunk one, see `scan_ahead()`.
+    """
+    text, offset, complete = read_chunk( view, index, size )
+    begin = index * LAZY_CHUNK_SIZE
+    end = min( size, begin + LAZY_CHUNK_SIZE )
+
+    starts[index] = [ get_chunk_start( chunks, position, index ) for position in range( len( matchers ) ) ]
+    return [ scan_text( matcher, text, offset, start, end, complete ) if is_bounded( matcher )
+            else scan_ahead( matcher, whole_text, start, end, ahead, position )
+            for position, ( matcher, start ) in enumerate( zip( matchers, starts[index] ) ) ]
+
+
+def scan_ahead(matcher, text, start, end, ahead, position):
+    """
+    Return the regions `matcher` finds beginning from `start` until `end` on the whole buffer `text`.
+    Where the first match after `end` begins is kept on `ahead`, so the scans of the next chunks do
+    not search again until it, when a rare regex would search until the end of the buffer each time.
+    """
+    scanned = ahead.get( position )
+
+    # no match begins between where the last scan started and the one it found after its chunk
+    if scanned is not None and scanned[0] <= start and end <= scanned[1]:
+        return Regions()
+
+    regions = Regions()
+    resume = start
+
+    for begin, match_end, term in matcher.finditer( text, start ):
+        if begin >= end: break
+
+        regions.append( begin, match_end, term )
+        resume = match_end
 
     else:
-        window = view.window() or sublime.active_window()
-        active_view = window.active_view()
-        return active_view, g_view_selections.setdefault( active_view.id(), Data( active_view ) )
+        begin = len( text )
 
+    # the positions inside the matches were not tried as the beginning of another one
+    ahead[position] = ( resume, begin )
+    return regions
 
-class HighlightWordsGarbageCollector(sublime_plugin.EventListener):
 
-    def on_pre_close(self, view):
-        if view.id() in g_view_selections:
-            view.run_command( 'unhighlight_words' )
-            del g_view_selections[view.id()]
+def fix_following_chunks(view, matchers, chunks, starts, index, size, whole_text):
+    """
+    Scan again the already scanned chunks after `index` whose scan should now resume from another
+    position, because a match found on the chunks before them crosses their border, or no longer
+    does. Only the start of their scan is done again, until it agrees with the old one.
+    """
+    for position, matcher in enumerate( matchers ):
+        following = index + 1
 
+        while following in chunks:
+            start = get_chunk_start( chunks, position, following )
+            old_start = starts[following][position]
+            if start == old_start: break
 
-class HighlightWordsCommand(sublime_plugin.TextCommand):
+            if is_bounded( matcher ):
+                text, offset, complete = read_chunk( view, following, size )
 
-    def __init__(self, view):
-        self.view = view
-        self.perwindow = False
-        self.perapplication = False
-        self.highlight_text_window = None
+            else:
+                text, offset, complete = whole_text, 0, True
 
-        self.disable_on_change = False
-        self.skip_highlight_search = False
+            end = min( size, ( following + 1 ) * LAZY_CHUNK_SIZE )
 
-    def get_words(self, text, skip_search=False):
-        if USE_REGEX:
+            # the old scan is only known from where it started
+            regions = chunks[following][position]
+            spliced = splice_regions( matcher, text, offset, start, max( start, old_start ), regions, 0 )
+
+            chunks[following][position] = regions_before( spliced.items(), end, offset + len( text ), complete )
+            starts[following][position] = start
+            following += 1
+
+
+def get_chunk_start(chunks, position, index):
+    """ Return where the scan of the chunk `index` resumes, after the last match of the scanned chunks before it """
+    begin = index * LAZY_CHUNK_SIZE
+
+    for previous in range( index - 1, -1, -1 ):
+        if previous not in chunks: break
+
+        regions = chunks[previous][position]
+        if regions: return max( begin, regions.ends[-1] )
+
+    return begin
+
+
+def is_bounded(matcher):
+    """
+    Whether the matches of `matcher` are all shorter than `INCREMENTAL_MARGIN`, so it finds the same
+    ones on the pieces of a text which overlap by it, or around a change, as on the whole text
+    """
+    return matcher.is_literal and matcher.max_length < INCREMENTAL_MARGIN
+
+
+def read_chunk(view, index, size):
+    """
+    Return the text of the chunk `index` plus `INCREMENTAL_MARGIN` characters around it, the
+    buffer position it begins at, and whether it goes until the end of the buffer
+    """
+    begin = index * LAZY_CHUNK_SIZE
+    offset = max( 0, begin - INCREMENTAL_MARGIN )
+    text_end = min( size, begin + LAZY_CHUNK_SIZE + INCREMENTAL_MARGIN )
+    return view.substr( sublime.Region( offset, text_end ) ), offset, text_end == size
+
+
+def parallel_scan(matcher, text):
+    """
+    Scan the `text` for `matcher` on the process pool, by line aligned chunks which overlap by
+    `INCREMENTAL_MARGIN` characters, then splice their regions in order, scanning again around each
+    border until they agree with the next chunk. Return None when the pool is not available.
+    """
+    pool = get_process_pool()
+    if pool is None: return None
+
+    size = len( text )
+    chunk_size = max( LAZY_CHUNK_SIZE, -( -size // g_process_pool_workers ) )
+    borders = [ 0 ]
+
+    while borders[-1] < size:
+        borders.append( text.find( '\n', borders[-1] + chunk_size ) + 1 or size )
+
+    try:
+        futures = []
+        for begin, end in zip( borders, borders[1:] ):
+            offset = max( 0, begin - INCREMENTAL_MARGIN )
+            text_end = min( size, end + INCREMENTAL_MARGIN )
+            futures.append( submit_task( pool, scan_text, matcher, text[offset:text_end], offset, begin, end, text_end == size ) )
+
+        chunks = [ future.result() for future in futures ]
+
+    # start a new pool on the next scan
+    except concurrent.futures.process.BrokenProcessPool:
+        shutdown_process_pool( pool=pool )
+        return None
+
+    except Exception:
+        log.exception( "Disabling the parallel scanning after it failed" )
+        shutdown_process_pool( False )
+        return None
+
+    regions = chunks[0]
+    for begin, chunk in zip( borders[1:], chunks[1:] ):
+        start = text.rfind( '\n', 0, max( 0, begin - INCREMENTAL_MARGIN ) ) + 1
+
+        if regions and regions.ends[-1] > start:
+            start = regions.ends[-1]
+
+        regions.extend( splice_regions( matcher, text, 0, start, begin, chunk, 0 ) )
+
+    return regions
+
+
+def get_process_pool():
+    """
+    Start the parallel scanning pool, returning None if it is disabled or could not start. Inside
+    Sublime Text `sys.executable` is not a Python interpreter, so it needs `parallel_scan_python`.
+    """
+    global g_process_pool
+    global g_process_pool_workers
+    if not PARALLEL_SCAN_PYTHON: return None
+
+    with g_process_pool_lock:
+        if g_process_pool is None:
 
             try:
-                filtered_words = []
-                unfiltered_words = []
-                tree = _parser.parse(text)
+                context = multiprocessing.get_context( 'spawn' )
+                context.set_executable( PARALLEL_SCAN_PYTHON )
 
-                for token in tree.children:
-                    # print( 'token', token.pretty() )
-                    if token.type == 'SEARCH':
-                        regex = token.strip(' ')
+                # the processes import the scanner as a module of this package
+                packages_directory = os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) )
+                g_process_pool_workers = PARALLEL_SCAN_PROCESSES or os.cpu_count() or 1
+                g_process_pool = concurrent.futures.ProcessPoolExecutor( g_process_pool_workers,
+                        mp_context=context, initializer=site.addsitedir, initargs=( packages_directory, ) )
 
-                        if skip_search:
-                            filtered_words.append( regex )
+            except Exception:
+                log.exception( "Could not start the parallel scanning processes" )
+                g_process_pool = False
 
-                        else:
-                            regex = regex.strip('/')
+        return g_process_pool or None
 
-                            # print('regex', regex)
-                            new = list( re.finditer(regex, self.view_text) )
 
-                            # print('new', [ item.groups() for item in new ] )
-                            if new: filtered_words.append( new )
+def shutdown_process_pool(retry=True, kill=False, pool=None):
+    """
+    Stop the parallel scanning pool, allowing it to start again if `retry`, and killing its running
+    tasks if `kill`. When a `pool` is given, only stop it if it is still the running one.
+    """
+    global g_process_pool
 
-                    elif token.type == 'WORDS':
-                        unfiltered_words.append(token)
+    with g_process_pool_lock:
+        if pool is not None and pool is not g_process_pool: return
 
-                other_words = list( filter( lambda x: x and x != ' ', re.split( r'((?:\\ |[^ ])+)', " ".join( unfiltered_words ) ) ) )
-                filtered_words.extend( other_words )
-                return filtered_words
+        if g_process_pool:
 
-            except Exception as e:
-                log( "regex message:", e )
-                return text.split()
+            if kill:
+                for process in g_process_pool_processes:
+                    process.terminate()
 
-        else:
-            return text.split()
+            g_process_pool.shutdown( wait=False )
 
-    def run(self, edit, perwindow=False, perapplication=False):
-        self.perwindow = perwindow
-        self.perapplication = perapplication
-        view = self.view
-        window = view.window() or sublime.active_window()
+        g_process_pool = None if retry else False
+        del g_process_pool_processes[:]
 
-        size = view.size()
-        if size > FILE_SIZE_LIMIT:
-            size = FILE_SIZE_LIMIT
 
-        self.view_text = view.substr( sublime.Region( 0, size ) )
-        self.highlight_text_window = None
-        highlight_text_all = SETTINGS.get('highlight_text', '')
+def submit_task(pool, function, *args):
+    """ Submit `function( *args )` to the process `pool`, keeping the processes it starts to kill them """
 
-        if not perapplication:
-            highlight_text_all = get_highlight_text( highlight_text_all, window.settings() )
-            self.highlight_text_window = highlight_text_all
+    # the pool starts its processes on the thread submitting the tasks
+    with g_process_pool_lock:
+        children = set( multiprocessing.active_children() )
+        future = pool.submit( function, *args )
 
-        if not perwindow and not perapplication:
-            highlight_text_all = get_highlight_text( highlight_text_all, view.settings() )
+        if pool is g_process_pool:
+            g_process_pool_processes.extend( process for process in multiprocessing.active_children() if process not in children )
 
-        # print('highlight_text', highlight_text_all)
-        word_list = self.get_words(highlight_text_all, skip_search=True)
-        old_display_list = ' '.join(word_list)
+    return future
 
-        for region in view.sel():
 
-            if UNDER_THE_CURSOR:
-                region = region.empty() and view.word(region) or region
+def submit_bounded(function, *args, deadline):
+    """
+    Start `function( *args, deadline )` on the process pool, returning the `(pool, future)` which
+    `run_bounded()` waits for, or None when the pool is not available
+    """
+    pool = get_process_pool()
+    if pool is None: return None
 
-            else:
-                if region.empty(): continue
+    try:
+        return pool, submit_task( pool, function, *args + ( deadline, ) )
 
-            cursor_word = view.substr(region).strip()
-            # print('cursor_word', cursor_word)
-            if not cursor_word: continue
+    except concurrent.futures.process.BrokenProcessPool:
+        shutdown_process_pool( pool=pool )
 
-            if USE_REGEX:
-                # ST uses perl regular expression syntax, escape all special characters
-                cursor_word = re.sub(r'([ \\.\[{}()\*+?|^$])', r'\\\1', cursor_word).replace('\t', '\\t').replace('\n', '\\n')
-                if WHOLE_WORD:
-                    cursor_word = "\\b" + cursor_word + "\\b"
-            if cursor_word in word_list:
-                word_list.remove(cursor_word)
-            else:
-                word_list.append(cursor_word)
-            break
+    except Exception:
+        log.exception( "Disabling the parallel scanning after it failed" )
+        shutdown_process_pool( False )
+
+    return None
+
+
+def run_bounded(function, *args, deadline=None, cancelled=None, submitted=None):
+    """
+    Return `function( *args, deadline, cancelled )`, raising TimeBudgetExceeded when it does not
+    finish before the `deadline`, which the regular expressions of a highlighting pass share, by
+    default `REGEX_TIME_BUDGET` seconds from now. The `re` module cannot be interrupted, so when
+    `parallel_scan_python` is set it runs on the process pool, whose processes are killed if it does
+    not finish, but cannot be `cancelled()`, or waits for the task `submit_bounded()` already
+    `submitted`. Otherwise, the time is only checked between the matches, not stopping a pattern
+    backtracking on a single one, which is only skipped after it finishes.
+    """
+    deadline = get_pass_deadline() if deadline is None else deadline
+
+    if time.time() > deadline:
+        if submitted is not None: submitted[1].cancel()
+        raise TimeBudgetExceeded()
+
+    submitted = submitted or submit_bounded( function, *args, deadline=deadline )
+
+    if submitted is not None:
+        pool, future = submitted
+
+        try:
+            return future.result( deadline - time.time() + REGEX_KILL_DELAY if deadline < float( 'inf' ) else None )
+
+        except concurrent.futures.TimeoutError:
+            shutdown_process_pool( kill=True )
+            raise TimeBudgetExceeded()
+
+        except TimeBudgetExceeded:
+            raise
+
+        # another task killed the pool while this one was running, or one of its processes died
+        except concurrent.futures.process.BrokenProcessPool:
+            shutdown_process_pool( pool=pool )
+
+        except Exception:
+            log.exception( "Disabling the parallel scanning after it failed" )
+            shutdown_process_pool( False )
+
+        # it may have been killed after the deadline by another task timing out
+        if time.time() > deadline:
+            raise TimeBudgetExceeded()
+
+    return function( *args + ( deadline, cancelled ) )
+
+
+def get_pass_deadline():
+    """ Return until when the regular expressions of a highlighting pass may scan """
+    return time.time() + REGEX_TIME_BUDGET if REGEX_TIME_BUDGET else float( 'inf' )
+
+
+def is_slow(started):
+    """
+    Whether a regular expression which started scanning at `started` and did not finish took most
+    of the time budget by itself, instead of finding it spent by the ones before it on the pass
+    """
+    return time.time() - started > REGEX_TIME_BUDGET / 2
+
+
+class Scheduler(object):
+    """
+    Run the tasks of a view on a single worker thread, after `delay` seconds without newer ones.
+    Scheduling a task with the same `key` as a pending one replaces it, and tells the running one
+    to stop through the `cancelled()` callback it receives.
+    """
+    idle_timeout = 60
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.thread = None
+        self.tasks = {}
+        self.generations = {}
+
+    def schedule(self, key, task, delay=0):
+        with self.condition:
+            self.generations[key] = self.generations.get( key, 0 ) + 1
+            self.tasks[key] = ( time.time() + delay, task )
+
+            if self.thread is None:
+                self.thread = threading.Thread( target=self._run )
+                self.thread.daemon = True
+                self.thread.start()
+
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            for key in self.generations:
+                self.generations[key] += 1
+
+            self.tasks.clear()
+            self.condition.notify()
+
+    def _next_task(self):
+        with self.condition:
+
+            while True:
+                if not self.tasks:
+                    if not self.condition.wait( self.idle_timeout ) and not self.tasks:
+                        self.thread = None
+                        return None
+                    continue
+
+                key = min( self.tasks, key=lambda key: self.tasks[key][0] )
+                deadline, task = self.tasks[key]
+                remaining = deadline - time.time()
+
+                if remaining > 0:
+                    self.condition.wait( remaining )
+                    continue
+
+                del self.tasks[key]
+                generation = self.generations[key]
+                return task, lambda: self.generations[key] != generation
+
+    def _run(self):
+
+        while True:
+            next_task = self._next_task()
+            if next_task is None: return
+            task, cancelled = next_task
+
+            try:
+                task( cancelled )
+
+            except Exception:
+                log.exception( "Failed running the task %s" % task )
+
+
+class BackgroundPool(object):
+    """
+    Run the queued tasks on up to `BACKGROUND_WORKERS` threads, the ones with the lowest `priority`
+    first. Queuing a task with the same `key` as a pending one replaces it, and tells the running
+    one to stop through the `cancelled()` callback it receives.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tasks = {}
+        self.generations = {}
+        self.workers = 0
+
+    def schedule(self, key, priority, task):
+        with self.condition:
+            self.generations[key] = self.generations.get( key, 0 ) + 1
+            self.tasks[key] = ( priority, task )
+
+            if self.workers < BACKGROUND_WORKERS:
+                self.workers += 1
+                thread = threading.Thread( target=self._run )
+                thread.daemon = True
+                thread.start()
+
+    def _next_task(self):
+        with self.condition:
+
+            if not self.tasks:
+                self.workers -= 1
+                return None
+
+            key = min( self.tasks, key=lambda key: self.tasks[key][0] )
+            priority, task = self.tasks.pop( key )
+            generation = self.generations[key]
+            return task, lambda: self.generations[key] != generation
+
+    def _run(self):
+
+        while True:
+            next_task = self._next_task()
+            if next_task is None: return
+            task, cancelled = next_task
+
+            try:
+                task( cancelled )
+
+            except Exception:
+                log.exception( "Failed running the background task %s" % task )
+
+
+g_background_pool = BackgroundPool()
+
+
+def State(view):
+
+    if view.id() in g_view_selections:
+        return view, g_view_selections.get( view.id() )
+
+    else:
+        window = view.window() or sublime.active_window()
+        active_view = window.active_view()
+        return active_view, g_view_selections.setdefault( active_view.id(), Data( active_view ) )
+
+
+class HighlightWordsGarbageCollector(sublime_plugin.EventListener):
+
+    def on_pre_close(self, view):
+        if view.id() in g_view_selections:
+            view.run_command( 'unhighlight_words' )
+            g_view_selections.pop( view.id() ).scheduler.cancel()
+
+            buffer_id = view.buffer_id()
+            if not any( state.view.buffer_id() == buffer_id for state in g_view_selections.values() ):
+                g_buffer_results.pop( ( buffer_id, 'words' ), None )
+                g_buffer_results.pop( ( buffer_id, 'keywords' ), None )
+                g_text_snapshots.pop( buffer_id, None )
+
+
+if hasattr( sublime_plugin, 'TextChangeListener' ):
+
+    class HighlightWordsTextChangeListener(sublime_plugin.TextChangeListener):
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            return True
+
+        def on_text_changed(self, changes):
+            for view in self.buffer.views():
+                state = g_view_selections.get( view.id() )
+
+                if state:
+                    for change in changes:
+                        state.record_change( change.a.pt, change.b.pt, change.a.pt + len( change.str ) )
+
+
+class HighlightWordsCommand(sublime_plugin.TextCommand):
+
+    def __init__(self, view):
+        self.view = view
+        self.perwindow = False
+        self.perapplication = False
+        self.highlight_text_window = None
+
+        self.disable_on_change = False
+        self.skip_highlight_search = False
+
+        self.snapshot = None
+        self.change_count = None
+        self.keywords_drawn = None
+        self.slow_terms = []
+        self.deadline = None
+        self.searched = None
+
+        self.confirmed = False
+        self.unsaved_settings = False
+        self.save_scheduled = False
+
+    def read_text(self):
+        """ Take the snapshot of the view text which is scanned, and the change count it is from """
+        self.snapshot = get_text_snapshot( self.view )
+        self.change_count = self.snapshot.change_count
+
+    def search(self, pattern, cancelled=None):
+        """ Return the `SearchMatch` of a `/regex/` search, by chunks on the larger buffers """
+        snapshot = self.snapshot
+
+        if snapshot.size <= FILE_SIZE_LIMIT:
+            return run_bounded( search_until, pattern, snapshot.text( self.view ), deadline=self.deadline, cancelled=cancelled )
+
+        search = ChunkedSearch( None, pattern )
+        for index in range( max( 1, -( -snapshot.size // LAZY_CHUNK_SIZE ) ) ):
+            search.chunks[index] = self.search_chunk( pattern, index, cancelled )
+
+        return search.matches()
+
+    def search_chunk(self, pattern, index, cancelled=None):
+        """ Return the `SearchMatch` of a `/regex/` search which begin inside the chunk `index` """
+        size = self.snapshot.size
+        text, offset, complete = read_chunk( self.view, index, size )
+        begin = index * LAZY_CHUNK_SIZE
+
+        return run_bounded( search_window, pattern, text, offset, begin, min( size, begin + LAZY_CHUNK_SIZE ), complete,
+                deadline=self.deadline, cancelled=cancelled )
+
+    def search_chunks(self, searches, cancelled, index):
+        """
+        Search the chunk `index` for each `ChunkedSearch` of the lazy scan. Only the time they take
+        counts on the time budget of the pass, not the one scanning the chunks took in between.
+        """
+        state = g_view_selections.setdefault( self.view.id(), Data( self.view ) )
+        self.deadline += time.time() - self.searched
+
+        for search in searches:
+            if search.failed: continue
+            started = time.time()
+
+            try:
+                search.chunks[index] = self.search_chunk( search.pattern, index, cancelled )
+
+            except TimeBudgetExceeded:
+                search.failed = True
+                if is_slow( started - search.spent ): state.slow_searches.add( ( search.pattern.pattern, search.pattern.flags ) )
+                self.slow_terms.append( search.regex )
+
+            search.spent += time.time() - started
+
+        self.searched = time.time()
+
+    def publish(self, cancelled, *callbacks):
+        """
+        Run the `callbacks` on the main thread in a single step, unless the buffer changed after
+        the text they were computed from was read, or a newer pass started.
+        """
+        view = self.view
+        change_count = self.change_count
+
+        def run():
+            if view.change_count() == change_count and not cancelled():
+                for callback in callbacks:
+                    callback()
+
+        sublime.set_timeout( run, 0 )
+
+    def get_words(self, text, skip_search=False, cancelled=None):
+        query = parse_query( text, USE_REGEX, IGNORE_CASE, WHOLE_WORD )
+
+        if query is None:
+            return text.split()
+
+        words = []
+        state = g_view_selections.setdefault( self.view.id(), Data( self.view ) )
+
+        if not skip_search:
+            state.slow_searches &= set( ( word[1].pattern, word[1].flags ) for word in query if isinstance( word, tuple ) )
+
+        for word in query:
+            if isinstance( word, tuple ):
+                regex, pattern = word
+
+                if skip_search:
+                    words.append( regex )
+
+                else:
+                    # print('regex', regex)
+                    started = time.time()
+
+                    try:
+                        if ( pattern.pattern, pattern.flags ) in state.slow_searches:
+                            raise TimeBudgetExceeded()
+
+                        # the larger buffers are searched by chunks along their lazy scan, unless it
+                        # needs all the captured texts to scan for their occurrences
+                        if self.snapshot.size > FILE_SIZE_LIMIT and not HIGHLIGHT_CAPTURED_OCCURRENCES:
+                            words.append( ChunkedSearch( regex, pattern ) )
+                            continue
+
+                        new = self.search( pattern, cancelled )
+
+                    except TimeBudgetExceeded:
+                        if is_slow( started ): state.slow_searches.add( ( pattern.pattern, pattern.flags ) )
+                        self.slow_terms.append( regex )
+                        continue
+
+                    # print('new', [ item.groups() for item in new ] )
+                    if new: words.append( new )
+
+            else:
+                words.append( word )
+
+        return words
+
+    def run(self, edit, perwindow=False, perapplication=False):
+        self.perwindow = perwindow
+        self.perapplication = perapplication
+        view = self.view
+        window = view.window() or sublime.active_window()
+
+        self.read_text()
+        self.highlight_text_window = None
+        highlight_text_all = SETTINGS.get('highlight_text', '')
+
+        if not perapplication:
+            self.highlight_text_window, highlight_text_all = get_view_highlight_text( view )
+
+        if perwindow:
+            highlight_text_all = self.highlight_text_window
+
+        # print('highlight_text', highlight_text_all)
+        word_list = self.get_words(highlight_text_all, skip_search=True)
+        old_display_list = ' '.join(word_list)
+
+        for region in view.sel():
+
+            if UNDER_THE_CURSOR:
+                region = region.empty() and view.word(region) or region
+
+            else:
+                if region.empty(): continue
+
+            cursor_word = view.substr(region).strip()
+            # print('cursor_word', cursor_word)
+            if not cursor_word: continue
+
+            if USE_REGEX:
+                # ST uses perl regular expression syntax, escape all special characters
+                cursor_word = re.sub(r'([ \\.\[{}()\*+?|^$])', r'\\\1', cursor_word).replace('\t', '\\t').replace('\n', '\\n')
+                if WHOLE_WORD:
+                    cursor_word = "\\b" + cursor_word + "\\b"
+            if cursor_word in word_list:
+                word_list.remove(cursor_word)
+            else:
+                word_list.append(cursor_word)
+            break
+
+        seen = set()
+        words = []
+        for item in word_list:
+            if item not in seen:
+                seen.add(item)
+                words.append(item)
+
+        display_list = ' '.join(words)
+        prompt = 'Highlight words for '
+
+        if perapplication:
+            prompt += "Global "
+        elif perwindow:
+            prompt += "Window "
+        else:
+            prompt += "View "
+
+        if USE_REGEX:
+            prompt += '(RegEx, '
+        else:
+            prompt += '(Literal, '
+        if IGNORE_CASE:
+            prompt += 'Ignore Case'
+        else:
+            prompt += 'Case Sensitive'
+
+        def on_done(text):
+            self.disable_on_change = False
+            self.skip_highlight_search = False
+            self.on_change(text, force=True)
+
+        # how many matches the words highlighted when the panel opened have
+        state = g_view_selections.get( view.id() )
+        if SHOW_MATCH_COUNTS and state and state.key_regions:
+            prompt += '; ' + get_match_counts( state, [ ( key, regions, None ) for key, regions in state.key_regions.items() ] )
+
+        prompt += '):'
+        prompt_view = window.show_input_panel( prompt, old_display_list, on_done, self.on_change, self.on_cancel )
+
+        self.skip_highlight_search = True
+        prompt_view.settings().set("word_wrap", True)
+        prompt_view.run_command( "highlight_words_clear_prompt_panel", { "display_list": display_list } )
+
+        self.skip_highlight_search = False
+        self.on_change(display_list)
+
+        sel = prompt_view.sel()
+        sel.clear()
+        sel.add(sublime.Region(0, prompt_view.size()))
+
+    def on_change(self, text, force=False):
+        if self.skip_highlight_search or self.disable_on_change and not force: return
+        self.confirmed = force
+
+        state = g_view_selections.setdefault( self.view.id(), Data( self.view ) )
+
+        def highlight(cancelled):
+            start_time = time.perf_counter()
+
+            with state.lock:
+                self.highlight(text, cancelled)
+
+            state.timings.add( 'total', time.perf_counter() - start_time )
+            if state.timings.last( 'total' ) > 1:
+                self.disable_on_change = True
+        state.scheduler.schedule( 'prompt', highlight, 0.5 )
+
+    def highlight(self, text, cancelled=lambda: False):
+        """ Return the `(key, regions, scope)` highlights published, or None when it stopped before """
+        # print('highlight text', text)
+        if not isinstance(text, str):
+            print("Error: text is not string", text)
+            return
+
+        view = self.view
+        state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+        if self.change_count != view.change_count():
+            self.read_text()
+
+        start_time = time.perf_counter()
+        self.slow_terms = []
+        self.deadline = get_pass_deadline()
+        results_key = get_results_key( view, text )
+        keywords_key = get_keywords_key( view )
+
+        try:
+            words_dirt = self.get_words( text, skip_search=False, cancelled=cancelled )
+
+        except ScanCancelled:
+            return
+
+        seen = set()
+        words = []
+        for item in words_dirt:
+            # the `/regex/` search matches are lists, which are never repeated
+            if isinstance( item, list ) or item not in seen:
+                if not isinstance( item, list ): seen.add(item)
+                words.append(item)
+
+        # print('highlight words', words)
+        seen = set()
+        text = ' '.join( item for item in self.get_words( text, skip_search=True ) if not ( item in seen or seen.add( item ) ) )
+        flag = 0
+
+        if not USE_REGEX:
+            flag |= sublime.LITERAL
+        if IGNORE_CASE:
+            flag |= sublime.IGNORECASE
+
+        searched_words = set()
+
+        # scan the buffer once for all the words and regex captured texts
+        terms = []
+        for word in words:
+            if isinstance( word, list ):
+                if HIGHLIGHT_CAPTURED_OCCURRENCES:
+                    terms.extend( ( search, flag | sublime.LITERAL ) for regexmatch in word for search in regexmatch.groups()[:99] if search )
+            elif isinstance( word, str ) and len( word ) > 1:
+                terms.append( ( word, flag ) )
+
+        term_patterns = []
+        for term, term_flag in terms:
+            if term in searched_words: continue
+            searched_words.add( term )
+
+            pattern = term_pattern( term, term_flag )
+            if pattern: term_patterns.append( ( term, pattern ) )
+
+        # the permanent keywords are scanned on the same pass, once when also a word, but by their
+        # own matchers, so a word never hides the keyword occurrences it overlaps
+        sources = set( ( pattern.pattern, pattern.flags ) for term, pattern in term_patterns )
+        keyword_patterns = []
+
+        for keyword, pattern, color, keyword_flag in KEYWORD_TERMS:
+            if pattern and ( pattern.pattern, pattern.flags ) not in sources:
+                sources.add( ( pattern.pattern, pattern.flags ) )
+                keyword_patterns.append( ( keyword, pattern ) )
+
+        matchers = Matcher.create( term_patterns ) + Matcher.create( keyword_patterns )
+        entries = self.get_entries( words )
+        state.timings.add( 'parse', time.perf_counter() - start_time )
+
+        if self.snapshot.size <= FILE_SIZE_LIMIT:
+
+            with state.timings.measure( 'scan' ):
+                if matchers:
+                    state.update_text( self.snapshot.text( view ) )
+
+                else:
+                    state.reset_text()
+
+                if cancelled(): return
+
+                state.submit_scans( matchers, self.deadline )
+                found = self.find_regions( state, matchers, cancelled )
+                if found is None: return
+
+                matcher_regions = [ regions for matcher, regions in found ]
+
+            term_regions = get_term_regions( [ matcher for matcher, regions in found ], matcher_regions )
+            drawn = self.add_regions( entries, flag, term_regions )
+            self.keywords_drawn = highlightGlobalKeywords( view, term_regions )
+            navigation = state.index_regions( drawn )
+
+            state.retain_regions( matchers )
+            if cancelled(): return
+
+            self.publish( cancelled,
+                    functools.partial( publish_results, view, 'keywords', keywords_key, self.keywords_drawn ),
+                    functools.partial( publish_results, view, 'words', results_key, drawn, navigation ),
+                    functools.partial( show_slow_terms, view, self.slow_terms ) )
+
+        else:
+            state.reset_text()
+            drawn = None
+
+            searches = [ word for word in words if isinstance( word, ChunkedSearch ) ]
+            search = functools.partial( self.search_chunks, searches, cancelled ) if searches else None
+            self.searched = time.time()
+
+            try:
+                for matcher_regions in state.timings.iterate( 'scan', scan_chunks( view, matchers, cancelled, search ) ):
+                    term_regions = get_term_regions( matchers, matcher_regions )
+                    drawn = self.add_regions( self.join_entries( entries ), flag, term_regions )
+                    self.keywords_drawn = highlightGlobalKeywords( view, term_regions )
+                    navigation = state.index_regions( drawn )
+
+                    self.publish( cancelled,
+                            functools.partial( draw_keywords, view, self.keywords_drawn ),
+                            functools.partial( draw_highlights, view, drawn, navigation ) )
+
+            except ScanCancelled:
+                return
+
+            if drawn is None or cancelled(): return
+
+            self.publish( cancelled,
+                    functools.partial( store_results, view, 'keywords', keywords_key, self.keywords_drawn ),
+                    functools.partial( store_results, view, 'words', results_key, drawn, navigation ),
+                    functools.partial( show_slow_terms, view, self.slow_terms ) )
+
+        # the query is saved even when the buffer changed since, which only makes its regions stale
+        sublime.set_timeout( functools.partial( self.save_highlight_text, text ), 0 )
+
+        # print('highlight end')
+        return drawn
+
+    def find_regions(self, state, matchers, cancelled):
+        """
+        Return the `(matcher, regions)` of the `matchers`, scanning again each term of a matcher which
+        did not finish on its time budget by itself, to skip only the slow ones with no regions.
+        Return None when it is `cancelled()` by a newer pass.
+        """
+        found = []
+
+        # the ones which did not get any time on the last pass go first
+        for matcher in sorted( matchers, key=lambda matcher: matcher.key not in state.deferred_keys ):
+            if cancelled(): return None
+
+            try:
+                found.append( ( matcher, state.find_regions( matcher, cancelled, self.deadline ) ) )
+
+            except ScanCancelled:
+                return None
+
+            except TimeBudgetExceeded:
+
+                if len( matcher.key ) > 1:
+                    split = self.find_regions( state, matcher.split(), cancelled )
+                    if split is None: return None
+
+                    found.extend( split )
+
+                else:
+                    self.slow_terms.append( matcher.key[0][0] )
+                    found.append( ( matcher, Regions() ) )
+
+        return found
+
+    def save_highlight_text(self, text):
+        view = self.view
+        state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+        with state.timings.measure( 'settings' ):
+
+            if self.perapplication or self.perwindow:
+
+                if self.perapplication:
+                    SETTINGS.set('highlight_text', text)
+                    self.unsaved_settings = True
+
+                else:
+                    window = view.window() or sublime.active_window()
+                    window.settings().set('highlight_text', text)
+
+                # while typing, only write the settings file from time to time
+                if self.confirmed:
+                    self.flush_highlight_text( rehighlight=True )
+
+                elif self.unsaved_settings and not self.save_scheduled:
+                    self.save_scheduled = True
+                    sublime.set_timeout( self.flush_highlight_text, int( HIGHLIGHT_TEXT_SAVE_INTERVAL * 1000 ) )
+            else:
+                if self.highlight_text_window:
+                    window_words = set( get_query_terms( self.highlight_text_window, USE_REGEX, IGNORE_CASE, WHOLE_WORD ) )
+                    text = " ".join( item for item in get_query_terms( text, USE_REGEX, IGNORE_CASE, WHOLE_WORD ) if item not in window_words )
+
+                # print( "Setting highlight_text", text )
+                view.settings().set('highlight_text', text)
+
+    def flush_highlight_text(self, rehighlight=False):
+        """
+        Write the application highlight text typed since the last time to the settings file, and
+        highlight the other views for it if `rehighlight`, when the input panel is confirmed
+        """
+        self.save_scheduled = False
+        view = self.view
+
+        if self.unsaved_settings:
+            self.unsaved_settings = False
+            sublime.save_settings('HighlightWords.sublime-settings')
+
+        if rehighlight:
+            activate_view( view )
+
+            if HIGHLIGHT_ALL_VIEWS:
+                highlight_all_views( sublime.windows() if self.perapplication else [ view.window() or sublime.active_window() ] )
+
+    def get_entries(self, words):
+        """
+        Return the `(identity, regions)` of the `words` in their highlighting order, computed once per
+        pass. The `regions` are the `Regions` of the `/regex/` search matches, or what `add_regions()`
+        looks up on the regions each scan found: the word itself, or the list of the captured texts.
+        """
+        entries = []
+        occurrences = {}
+        unsorted = set()
+
+        word_set = set()
+        searched_words = set()
+
+        for word in words:
+            if isinstance( word, list ):
+                for regexmatch in word:
+                    groups = regexmatch.groups()[:99]
+                    regions = occurrences.get( groups )
+
+                    if regions is None:
+                        regions = occurrences[groups] = [] if HIGHLIGHT_CAPTURED_OCCURRENCES else Regions()
+                        entries.append( ( groups, regions ) )
+
+                    if HIGHLIGHT_CAPTURED_OCCURRENCES:
+                        words_to_search = [ search for search in groups if search and search not in searched_words ]
+                        searched_words.update( words_to_search )
+                        regions.extend( words_to_search )
+                        continue
+
+                    # the whole match when the regex has no groups, appended in the order of the
+                    # matches, which only the groups inside a lookaround can go back on
+                    spans = sorted( regexmatch.span( group ) for group in range( 1, len( groups ) + 1 ) ) or [ regexmatch.span() ]
+
+                    for begin, end in spans:
+                        if end <= begin: continue
+
+                        last = regions[-1] if regions else None
+                        if last == ( begin, end ): continue
+
+                        if last is not None and last > ( begin, end ):
+                            unsorted.add( groups )
+
+                        regions.append( begin, end )
+
+            elif isinstance( word, ChunkedSearch ):
+                entries.append( ( word, word ) )
+
+            else:
+                if len(word) < 2: continue
+                if word in word_set: continue
+                word_set.add(word)
+                entries.append( ( word, word ) )
+
+        return [ ( identity, Regions( region for region, duplicates in itertools.groupby( sorted( regions ) ) ) if identity in unsorted else regions )
+                for identity, regions in entries ]
+
+    def join_entries(self, entries):
+        """ Return the `get_entries()` with each `ChunkedSearch` replaced by the entries of its chunks searched so far """
+        joined = []
+        positions = {}
+
+        for identity, regions in entries:
+
+            if not isinstance( regions, ChunkedSearch ):
+                joined.append( ( identity, regions ) )
+                continue
+
+            # the searches capturing the same texts share their highlight
+            for identity, regions in regions.get_entries( self.get_entries ):
+
+                if identity in positions:
+                    position = positions[identity]
+                    joined[position] = ( identity, merge_regions( [ joined[position][1], regions ] ) )
+
+                else:
+                    positions[identity] = len( joined )
+                    joined.append( ( identity, regions ) )
+
+        return joined
+
+    def add_regions(self, entries, flag, term_regions):
+        """ Return the `(key, regions, scope)` highlights of the `get_entries()` with the `term_regions` found """
+        view = self.view
+
+        def find_all(term, flag=flag):
+            regions = get_pattern_regions( term_regions, term_pattern( term, flag ) )
+            if regions is not None:
+                return regions
+            return Regions( ( region.begin(), region.end() ) for region in view.find_all( term, flag ) )
+
+        # merge the regions of all matches capturing the same texts, sorted like the words ones
+        regions_list = []
+
+        for identity, regions in entries:
+            if isinstance( regions, str ):
+                regions = find_all( regions )
+
+            elif isinstance( regions, list ):
+                regions = merge_regions( [ find_all( search, flag | sublime.LITERAL ) for search in regions ] )
+
+            regions_list.append( regions )
+
+        state = g_view_selections.setdefault( view.id(), Data( view ) )
+        slots = state.assign_slots( [ identity for identity, regions in entries ] )
+
+        return [ ( '%s_%d' % ( g_regionkey, slot ), regions, SCOPES[slot % len(SCOPES)] )
+                for slot, regions in zip( slots, regions_list ) ]
+
+    def on_cancel(self):
+        self.flush_highlight_text()
+
+        view = self.view
+        view, state = State( view )
+        view.run_command('unhighlight_words')
+
+        if CLEAR_ON_ESCAPE:
+            view.settings().erase('highlight_text')
+
+
+class HighlightWordsClearPromptPanelCommand(sublime_plugin.TextCommand):
+    def run(self, edit, display_list):
+        view = self.view
+        view.erase( edit, sublime.Region( 0, view.size() ) )
+        view.insert( edit, 0, display_list )
+
+
+def draw_highlights(view, drawn, navigation):
+    """
+    Draw the `(key, regions, scope)` highlights, erasing the ones from previous passes, and publish
+    their `navigation` index from `Data.index_regions()`
+    """
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+    with state.timings.measure( 'add_regions' ):
+        add_changed_regions( view, state, drawn )
+
+    # trim extra/unrequired regions
+    keys = set( key for key, regions, scope in drawn )
+    size = max( [ get_key_slot( key ) + 1 for key in keys ] or [ 0 ] )
+    highlight_size = view.settings().get('highlight_size', 0)
+
+    with state.timings.measure( 'erase' ):
+        for index in range( max( size, highlight_size ) ):
+            erase_stale_region( view, state, '%s_%d' % ( g_regionkey, index ), keys )
+
+    if size != highlight_size:
+        view.settings().set('highlight_size', size)
+
+    state.set_regions( navigation )
+    show_match_count( view, drawn )
+    draw_overview( view, state, drawn )
+
+    if state.selected_region_index < len( state.added_regions ):
+        active_region = view.get_regions( '%s_active_selection' % g_regionkey )
+
+        if active_region:
+            region_borders = (active_region[0].begin(), active_region[0].end())
+
+            if not state.contains( region_borders ):
+                erase_active_region( view )
+
+    else:
+        erase_active_region( view )
+
+
+def get_term_regions(matchers, matcher_regions):
+    """ Split the regions each matcher found by the `( pattern, flags )` of the term which matched them """
+    term_regions = {}
+
+    for matcher, regions in zip( matchers, matcher_regions ):
+        buckets = [ Regions() for key in matcher.key ]
+
+        for begin, end, term in regions.items():
+            buckets[term].append( begin, end )
+
+        term_regions.update( zip( ( ( source, flags ) for term, source, flags in matcher.key ), buckets ) )
+
+    return term_regions
+
+
+def get_pattern_regions(term_regions, pattern):
+    """ Return the regions the compiled `pattern` matched, or None when it was not scanned """
+    return term_regions.get( ( pattern.pattern, pattern.flags ) ) if pattern else None
+
+
+def merge_regions(regions_list):
+    """ Return the sorted union of the `Regions` on the list, without the repeated ones """
+    if len( regions_list ) == 1:
+        return regions_list[0]
+
+    regions = Regions()
+
+    for ( begin, end ), duplicates in itertools.groupby( heapq.merge( *regions_list ) ):
+        regions.append( begin, end )
+
+    return regions
+
+
+def join_regions(regions_list):
+    """ Return the union of the sorted `Regions` of consecutive chunks, appended one after the other unless they overlap """
+    regions_list = [ regions for regions in regions_list if regions ] or [ Regions() ]
+
+    if len( regions_list ) == 1:
+        return regions_list[0]
+
+    if any( previous[-1] >= regions[0] for previous, regions in zip( regions_list, regions_list[1:] ) ):
+        return merge_regions( regions_list )
+
+    joined = Regions()
+    for regions in regions_list:
+        joined.extend( regions )
+
+    return joined
+
+
+def get_key_slot(key):
+    """ Return the index of a `HighlightWords_%d` key """
+    return int( key[len( g_regionkey ) + 1:] )
+
+
+def draw_keywords(view, drawn):
+    """ Draw the `(key, regions, color)` keywords, erasing the ones of mappings removed since the last pass """
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+    add_changed_regions( view, state, drawn )
 
-        seen = set()
-        words = []
-        for item in word_list:
-            if item not in seen:
-                seen.add(item)
-                words.append(item)
+    keys = set( key for key, regions, scope in drawn )
+    size = len( drawn )
+    keywords_size = view.settings().get('highlight_keywords_size', 0)
 
-        display_list = ' '.join(words)
-        prompt = 'Highlight words for '
+    for index in range( max( size, keywords_size ) ):
+        erase_stale_region( view, state, 'highlight_keyword_%d' % index, keys )
 
-        if perapplication:
-            prompt += "Global "
-        elif perwindow:
-            prompt += "Window "
-        else:
-            prompt += "View "
+    if size != keywords_size:
+        view.settings().set('highlight_keywords_size', size)
+
+
+def add_changed_regions(view, state, drawn):
+    """
+    Add the `(key, regions, scope)` highlights, skipping the ones already drawn with the same regions
+    and scope. The keys with more regions than `TERM_REGION_BUDGET`, and the largest ones after the
+    view has `TOTAL_REGION_BUDGET` regions, only have the regions near the viewport drawn.
+    """
+    keys = set( key for key, regions, scope in drawn )
+    budget = TOTAL_REGION_BUDGET - sum( len( value[0] ) for key, value in state.drawn.items() if value and key not in keys )
+
+    capped = set()
+    for key, regions, scope in sorted( drawn, key=lambda item: len( item[1] ) ):
+
+        if TERM_REGION_BUDGET and len( regions ) > TERM_REGION_BUDGET or TOTAL_REGION_BUDGET and len( regions ) > budget:
+            capped.add( key )
 
-        if USE_REGEX:
-            prompt += '(RegEx, '
-        else:
-            prompt += '(Literal, '
-        if IGNORE_CASE:
-            prompt += 'Ignore Case'
         else:
-            prompt += 'Case Sensitive'
+            budget -= len( regions )
 
-        def on_done(text):
-            self.disable_on_change = False
-            self.skip_highlight_search = False
-            self.on_change(text, force=True)
+    window = get_render_window( view ) if capped else None
 
-        prompt += '):'
-        prompt_view = window.show_input_panel( prompt, old_display_list, on_done, self.on_change, self.on_cancel )
+    for key, regions, scope in drawn:
 
-        self.skip_highlight_search = True
-        prompt_view.settings().set("word_wrap", True)
-        prompt_view.run_command( "highlight_words_clear_prompt_panel", { "display_list": display_list } )
+        if key in capped:
+            state.capped[key] = ( regions, scope )
+            regions = get_window_regions( regions, window )
 
-        self.skip_highlight_search = False
-        self.on_change(display_list)
+        else:
+            state.capped.pop( key, None )
 
-        sel = prompt_view.sel()
-        sel.clear()
-        sel.add(sublime.Region(0, prompt_view.size()))
+        add_region( view, state, key, regions, scope )
 
-    def on_change(self, text, force=False):
-        if self.skip_highlight_search or self.disable_on_change and not force: return
+    if capped:
+        state.render_window = window
+        state.scheduler.schedule( 'viewport', functools.partial( follow_viewport, view ), VIEWPORT_POLL_INTERVAL )
 
-        stamp = time.time()
-        self.stamp = stamp
 
-        def highlight():
-            time.sleep(0.5)
-            self.highlight(text, stamp)
-            if time.time() - stamp > 1:
-                self.disable_on_change = True
+def add_region(view, state, key, regions, scope):
+    if state.drawn.get( key ) != ( regions, scope ):
+        view.add_regions( key, [ sublime.Region( begin, end ) for begin, end in regions ], scope, '', sublime.HIDE_ON_MINIMAP )
+        state.drawn[key] = ( regions, scope )
 
-        threading.Thread( target=highlight ).start()
 
-    def highlight(self, text, stamp):
-        # print('highlight text', text)
-        # print('highlight stamp', stamp)
-        if self.stamp != stamp:
-            return
+def get_render_window(view):
+    """ Return the `(begin, end)` of the visible region, plus `VIEWPORT_MARGIN` times its size around it """
+    visible = view.visible_region()
+    margin = max( visible.size(), 1 ) * VIEWPORT_MARGIN
+    return max( 0, visible.begin() - margin ), visible.end() + margin
 
-        if not isinstance(text, str):
-            print("Error: text is not string", text)
-            return
 
-        view = self.view
-        words_dirt = self.get_words( text, skip_search=False )
+def get_window_regions(regions, window):
+    """ Return up to `TERM_REGION_BUDGET` of the sorted `regions` beginning inside the `window` """
+    start = regions.find( window[0] )
+    end = regions.find( window[1], start )
+    return regions.slice( start, min( end, start + TERM_REGION_BUDGET ) if TERM_REGION_BUDGET else end )
 
-        seen = set()
-        words = []
-        for item in words_dirt:
-            if item not in seen:
-                seen.add(item)
-                words.append(item)
 
-        # print('highlight words', words)
-        text = ' '.join(words)
+def follow_viewport(view, cancelled):
+    """ Draw again the keys over the region budgets when the view was scrolled away from their regions drawn """
+    state = g_view_selections.get( view.id() )
+    if cancelled() or not state or not state.capped: return
 
-        size = 0
-        flag = 0
-        color_switch = 0
+    visible = view.visible_region()
+    window = state.render_window
 
-        if not USE_REGEX:
-            flag |= sublime.LITERAL
-        if IGNORE_CASE:
-            flag |= sublime.IGNORECASE
+    if visible.begin() < window[0] or visible.end() > window[1]:
+        sublime.set_timeout( functools.partial( draw_near_viewport, view ), 0 )
 
-        word_set = set()
-        added_regions = set()
-        searched_words = set()
+    state.scheduler.schedule( 'viewport', functools.partial( follow_viewport, view ), VIEWPORT_POLL_INTERVAL )
 
-        for word in words:
-            if isinstance( word, list ):
-                for regexmatch in word:
-                    words_to_search = []
-                    regions = []
 
-                    # print('color_switch', color_switch, )
-                    try:
-                        for index in range(1, 100):
-                            match = regexmatch.group( index )
-                            if match is None:
-                                continue
-                            words_to_search.append( match )
-                    except IndexError:
-                        pass
+def draw_near_viewport(view):
+    state = g_view_selections.get( view.id() )
+    if not state or not state.capped: return
 
-                    for search in words_to_search:
+    window = get_render_window( view )
+    state.render_window = window
 
-                        if search in searched_words:
-                            continue
+    for key, ( regions, scope ) in list( state.capped.items() ):
+        add_region( view, state, key, get_window_regions( regions, window ), scope )
 
-                        regions.extend( view.find_all(search, flag) )
-
-                    # print( "regions", regions )
-                    searched_words.update( words_to_search )
-
-                    added_regions.update( [ (region.begin(), region.end()) for region in regions] )
-                    view.add_regions(
-                            '%s_%d' % ( g_regionkey, size ),
-                            regions,
-                            SCOPES[color_switch % len(SCOPES)] ,
-                            '',
-                            sublime.HIDE_ON_MINIMAP
-                        )
-                    size += 1
-                    color_switch += 1
-            else:
-                if len(word) < 2: continue
-                if word in word_set: continue
-                word_set.add(word)
 
-                regions = view.find_all(word, flag)
-                added_regions.update( [ (region.begin(), region.end()) for region in regions] )
+def erase_stale_region(view, state, key, keys=()):
+    """ Erase the regions of `key` when it is not on `keys`, unless it is known to be erased already """
+    if key not in keys and state.drawn.get( key, () ) is not None:
+        view.erase_regions( key )
+        state.drawn[key] = None
+        state.capped.pop( key, None )
 
-                view.add_regions(
-                        '%s_%d' % ( g_regionkey, size ),
-                        regions,
-                        SCOPES[color_switch % len(SCOPES)],
-                        '',
-                        sublime.HIDE_ON_MINIMAP
-                    )
-                size += 1
-                color_switch += 1
 
-        # trim extra/unrequired regions
-        highlight_size = view.settings().get('highlight_size', 0)
+class Results(object):
+    """ The highlights drawn on the views of a buffer, valid while their `key` does not change """
 
-        if highlight_size and size < highlight_size:
-            for index in range(size, highlight_size):
-                view.erase_regions('%s_%d' % ( g_regionkey, index ) )
+    def __init__(self, key, drawn, navigation=None):
+        self.key = key
+        self.drawn = drawn
+        self.navigation = navigation
 
-        view.settings().set('highlight_size', size)
 
-        if self.perapplication:
-            SETTINGS.set('highlight_text', text)
-            HighlightKeywordsCommand.instance.on_activated(view)
-            sublime.save_settings('HighlightWords.sublime-settings')
+def get_results_key(view, text):
+    # the merged view highlight text may end with a space the input panel text does not have
+    return ( view.change_count(), hash( text.strip() ), SETTINGS_KEY )
 
-        elif self.perwindow:
-            window = view.window() or sublime.active_window()
-            window.settings().set('highlight_text', text)
-            HighlightKeywordsCommand.instance.on_activated(view)
-        else:
-            if self.highlight_text_window:
-                all_words = self.get_words(text, skip_search=True)
-                window_words = self.get_words(self.highlight_text_window, skip_search=True)
-                window_words = set(window_words)
-                text = " ".join(item for item in all_words if item not in window_words)
 
-            # print( "Setting highlight_text", text )
-            view.settings().set('highlight_text', text)
+def get_keywords_key(view):
+    return ( view.change_count(), KEYWORDS_KEY )
 
-        state = g_view_selections.setdefault( view.id(), Data( view ) )
-        state.add_regions_set( added_regions )
 
-        if state.selected_region_index < len( state.added_regions ):
-            active_region = view.get_regions( '%s_active_selection' % g_regionkey )
+def publish_results(view, kind, key, drawn, navigation=None):
+    """
+    Draw the highlights of `kind`, with the `navigation` index of the words, and cache them for the
+    other views of the buffer
+    """
+    draw_results( view, kind, drawn, navigation )
+    store_results( view, kind, key, drawn, navigation )
 
-            if active_region:
-                region_borders = (active_region[0].begin(), active_region[0].end())
 
-                if region_borders not in added_regions:
-                    erase_active_region( view )
+def store_results(view, kind, key, drawn, navigation=None):
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+    state.results_keys[kind] = key
+    g_buffer_results[( view.buffer_id(), kind )] = Results( key, drawn, navigation )
 
-        else:
-            erase_active_region( view )
 
-        # print('highlight end')
+def draw_results(view, kind, drawn, navigation=None):
+    if kind == 'words':
+        draw_highlights( view, drawn, navigation )
 
-    def on_cancel(self):
-        view = self.view
-        view, state = State( view )
-        view.run_command('unhighlight_words')
+    else:
+        draw_keywords( view, drawn )
 
-        if CLEAR_ON_ESCAPE:
-            view.settings().erase('highlight_text')
 
+def apply_cached_results(view, kind, key):
+    """
+    Return whether the highlights of `kind` cached for the view buffer are still valid for `key`,
+    drawing them when the view does not show them yet, e.g., a clone of an highlighted view.
+    """
+    results = g_buffer_results.get( ( view.buffer_id(), kind ) )
 
-class HighlightWordsClearPromptPanelCommand(sublime_plugin.TextCommand):
-    def run(self, edit, display_list):
-        view = self.view
-        view.erase( edit, sublime.Region( 0, view.size() ) )
-        view.insert( edit, 0, display_list )
+    if results is None or results.key != key:
+        return False
+
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+    if state.results_keys.get( kind ) != key:
+        state.results_keys[kind] = key
+        draw_results( view, kind, results.drawn, results.navigation )
+
+    return True
 
 
 def erase_active_region(view):
@@ -462,8 +2029,10 @@ class SelectNextHighlightedWordCommand(sublime_plugin.TextCommand):
 
         # print("highlight_size", highlight_size)
         if state.added_regions:
-            target_points = state.target_points( backwards=False )
-            show_regions( view, target_points )
+
+            with state.timings.measure( 'navigation' ):
+                target_points = state.target_points( backwards=False )
+                show_regions( view, target_points )
 
 
 class SelectPreviousHighlightedWordCommand(sublime_plugin.TextCommand):
@@ -474,8 +2043,10 @@ class SelectPreviousHighlightedWordCommand(sublime_plugin.TextCommand):
 
         # print("highlight_size", highlight_size)
         if state.added_regions:
-            target_points = state.target_points( backwards=True )
-            show_regions( view, target_points )
+
+            with state.timings.measure( 'navigation' ):
+                target_points = state.target_points( backwards=True )
+                show_regions( view, target_points )
 
 
 def show_regions(view, target_points):
@@ -517,10 +2088,18 @@ class UnhighlightWordsCommand(sublime_plugin.TextCommand):
         view = self.view
         view, state = State( view )
         erase_active_region( view )
+        state.results_keys.pop( 'words', None )
 
         highlight_size = view.settings().get('highlight_size', 0)
-        for index in range(highlight_size):
-            view.erase_regions('%s_%d' % ( g_regionkey, index ) )
+        with state.timings.measure( 'erase' ):
+            for index in range(highlight_size):
+                erase_stale_region( view, state, '%s_%d' % ( g_regionkey, index ) )
+
+        state.word_slots = {}
+        state.set_regions( ( {}, Regions() ) )
+        view.erase_status( g_status_key )
+        view.erase_status( g_slow_status_key )
+        draw_overview( view, state, [] )
 
         view.settings().set('highlight_size', 0)
 
@@ -548,97 +2127,463 @@ class HighlightSettingsCommand(sublime_plugin.WindowCommand):
         sublime.save_settings('HighlightWords.sublime-settings')
 
 
-def highlightGlobalKeywords(view):
-    """ See the setting `permanent_highlight_keyword_color_mappings` """
-    size = 0
-    word_set = set()
-    for pair in KEYWORD_MAP:
-        word = pair['keyword']
-        color = pair['color']
-        flag = pair.get('flag', sublime.LITERAL)
-        if (word and color):
-            if word in word_set:
-                continue
-            word_set.add(word)
-            regions = view.find_all(word, flag)
-            view.add_regions('highlight_keyword_%d' % size, regions, color, '', sublime.HIDE_ON_MINIMAP)
-            size += 1
+class HighlightWordsResultsCommand(sublime_plugin.TextCommand):
+    """
+    List the highlighted matches on a quick panel grouped by word, with their line number and text.
+    Only `RESULTS_PAGE_SIZE` entries are built at a time, the last one loading the next page.
+    """
+
+    def run(self, edit):
+        view = self.view
+        view, state = State( view )
 
+        labels = get_key_labels( state )
+        key_regions = sorted( state.key_regions.items(), key=lambda item: get_key_slot( item[0] ) )
+        self.total = sum( len( regions ) for key, regions in key_regions )
 
-def delayedFix(self, stamp):
-    # print( 'self.is_running %s. %s , self.stamp %s/%s' % ( self.is_running, self.stamp != stamp, self.stamp, stamp) )
-    if self.stamp != stamp or self.is_running:
-        return
+        if not self.total:
+            sublime.status_message( "No highlighted words to list" )
+            return
 
-    try:
-        self.is_running = True
-        time.sleep(0.1 + self.running_time * 2)
-        start_time = time.time()
+        self.target_view = view
+        self.results = self.iterate_results( view, key_regions, labels )
+        self.items = []
+        self.regions = []
+        self.show_page( 0 )
 
-        window = sublime.active_window()
-        view = window.active_view()
+    def iterate_results(self, view, key_regions, labels):
 
-        # print('delayedFix running...')
-        highlightGlobalKeywords( view )
+        for key, regions in key_regions:
+            label = labels.get( get_key_slot( key ), key )
 
-        size = view.size()
-        if size > FILE_SIZE_LIMIT:
-            size = FILE_SIZE_LIMIT
+            for index, (begin, end) in enumerate( regions ):
+                row, column = view.rowcol( begin )
+                line = view.line( begin )
 
-        highlighter = HighlightWordsCommand( view )
-        highlighter.view_text = view.substr( sublime.Region( 0, size ) )
+                context = view.substr( sublime.Region(
+                        max( line.begin(), begin - RESULTS_CONTEXT_SIZE // 2 ),
+                        min( line.end(), end + RESULTS_CONTEXT_SIZE // 2 ) ) )
 
-        highlight_text_all = SETTINGS.get('highlight_text', '')
-        highlight_text_all = get_highlight_text( highlight_text_all, window.settings() )
+                yield [ '%s  %d/%d' % ( label, index + 1, len( regions ) ), '%d: %s' % ( row + 1, context.strip() ) ], ( begin, end )
+
+    def show_page(self, selected_index):
+
+        for item, region in itertools.islice( self.results, RESULTS_PAGE_SIZE ):
+            self.items.append( item )
+            self.regions.append( region )
+
+        items = self.items
+        remaining = self.total - len( self.regions )
+
+        if remaining > 0:
+            items = items + [ [ 'More results...', '%d of %d results not listed yet' % ( remaining, self.total ) ] ]
+
+        window = self.target_view.window() or sublime.active_window()
+        window.show_quick_panel( items, self.on_done, 0, selected_index, self.on_highlight )
+
+    def on_done(self, index):
+        if index == -1: return
+
+        if index == len( self.regions ):
+            sublime.set_timeout( lambda: self.show_page( index ), 0 )
+            return
+
+        view = self.target_view
+        begin, end = self.regions[index]
+
+        erase_active_region( view )
+        view.sel().clear()
+        view.sel().add( sublime.Region( begin, end ) )
+        show_regions( view, ( begin, end ) )
+
+    def on_highlight(self, index):
+        if index < len( self.regions ):
+            self.target_view.show_at_center( sublime.Region( *self.regions[index] ) )
+
+
+class HighlightWordsTimingsCommand(sublime_plugin.TextCommand):
+    """ Show how long each highlighting step took on the last passes over the current view """
+
+    def run(self, edit):
+        view = self.view
+        view, state = State( view )
+        window = view.window() or sublime.active_window()
+
+        report = "Highlight timings in milliseconds over the last %s passes on the view %s (%s):\n\n%s\n" % (
+                TIMINGS_SAMPLES, view.id(), view.file_name() or view.name(), state.timings.report() )
+
+        panel = window.create_output_panel( 'highlight_words_timings' )
+        panel.run_command( 'append', { 'characters': report } )
+        window.run_command( 'show_panel', { 'panel': 'output.highlight_words_timings' } )
+
+
+def highlightGlobalKeywords(view, term_regions):
+    """
+    See the setting `permanent_highlight_keyword_color_mappings`. The keywords regions come from the
+    `term_regions` scanned with the words, unless they are not supported by the Python regular
+    expressions.
+    """
+    drawn = []
+
+    for index, (word, pattern, color, flag) in enumerate( KEYWORD_TERMS ):
+        regions = get_pattern_regions( term_regions, pattern )
+
+        if regions is None:
+            regions = Regions( ( region.begin(), region.end() ) for region in view.find_all( word, flag ) )
 
-        highlighter.highlight_text_window = highlight_text_all
-        highlight_text_all = get_highlight_text( highlight_text_all, view.settings() )
+        drawn.append( ( 'highlight_keyword_%d' % index, regions, color ) )
+
+    return drawn
+
+
+def delayedFix(view, cancelled, use_disk_cache=True):
+    start_time = time.perf_counter()
+
+    # print('delayedFix running...')
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+    # the background highlighting may run it while the view scheduler does too
+    with state.lock:
+        highlighter = HighlightWordsCommand( view )
+        highlighter.read_text()
+
+        keywords_key = get_keywords_key( view )
+        highlight_text_window, highlight_text_all = get_view_highlight_text( view )
         # print('highlight_text', highlight_text_all)
 
-        highlighter.stamp = 1
-        highlighter.highlight( highlight_text_all, 1 )
-        end_time = time.time()
-        self.running_time = end_time - start_time
-    finally:
-        self.is_running = False
+        file_key = get_file_key( view )
+        words_query = ( highlight_text_all, SETTINGS_KEY )
+
+        # draw the highlights stored for the file right away, and check them a while later
+        if use_disk_cache and file_key and not is_buffer_highlighted( view ) \
+                and apply_disk_results( highlighter, file_key, words_query, cancelled ):
+            state.scheduler.schedule( 'modified', functools.partial( delayedFix, view, use_disk_cache=False ), DISK_CACHE_VERIFY_DELAY )
+            return
+
+        # both are drawn when the view does not show them yet, e.g., a clone
+        keywords_cached = apply_cached_results( view, 'keywords', keywords_key )
+        words_cached = apply_cached_results( view, 'words', get_results_key( view, highlight_text_all ) )
+        if keywords_cached and words_cached: return
+
+        highlighter.highlight_text_window = highlight_text_window
+        drawn = highlighter.highlight( highlight_text_all, cancelled )
+        state.timings.add( 'total', time.perf_counter() - start_time )
+
+        if file_key and drawn is not None and view.change_count() == highlighter.change_count:
+            save_disk_results( file_key, 'keywords', KEYWORDS_KEY, highlighter.keywords_drawn )
+            save_disk_results( file_key, 'words', words_query, drawn )
+
+
+def highlight_all_views(windows):
+    """ Highlight the views of the `windows` on the background, the visible ones first """
+    active_window = sublime.active_window()
+    views = []
+
+    for window in windows:
+        visible = [ window.active_view_in_group( group ) for group in range( window.num_groups() ) ]
+        visible = set( view.id() for view in visible if view )
+
+        for index, view in enumerate( window.views() ):
+            views.append( ( ( view.id() not in visible, window.id() != active_window.id(), index ), view ) )
+
+    for priority, view in sorted( views, key=lambda item: item[0] ):
+        g_background_pool.schedule( view.id(), priority, functools.partial( highlight_in_background, view ) )
+
+
+def highlight_in_background(view, cancelled):
+    if view.window() is None or cancelled(): return
+    delayedFix( view, cancelled )
+
+
+def show_match_count(view, drawn):
+    """ Show on the status bar how many matches the view has, and each of its words """
+    if ( SHOW_MATCH_COUNTS or HIGHLIGHT_ALL_VIEWS ) and drawn:
+        status = "Highlighted: %d" % sum( len( regions ) for key, regions, scope in drawn )
+
+        state = g_view_selections.setdefault( view.id(), Data( view ) )
+
+        if SHOW_MATCH_COUNTS:
+            status += " (%s)" % get_match_counts( state, drawn )
 
+        capped = sum( 1 for key, regions, scope in drawn if key in state.capped )
+        if capped:
+            status += ", %d only drawn near the viewport" % capped
 
-def get_highlight_text(all_text, settings):
-    if all_text:
-        view_text = settings.get('highlight_text', '')
+        view.set_status( g_status_key, status )
+
+    else:
+        view.erase_status( g_status_key )
+
+
+def get_key_labels(state):
+    """ Return the word of each highlight key slot, or the texts its `/regex/` search captured """
+    labels = {}
+
+    for identity, slot in state.word_slots.items():
+        labels[slot] = identity if isinstance( identity, str ) else ' '.join( group for group in identity if group )
+
+    return labels
+
+
+def get_match_counts(state, drawn):
+    """ Return the `word count` of the `(key, regions, scope)` highlights, on the order of their keys """
+    labels = get_key_labels( state )
+    slot_regions = sorted( ( get_key_slot( key ), regions ) for key, regions, scope in drawn )
+
+    return ', '.join( '%s %d' % ( labels.get( slot ) or '#%d' % slot, len( regions ) ) for slot, regions in slot_regions )
+
+
+def draw_overview(view, state, drawn):
+    """
+    Mark on the gutter where the matches are, by dividing the view on `OVERVIEW_BUCKETS` parts with
+    the histograms of the regions, and drawing one mark per part on the line of its first match,
+    colored by how many matches it has compared to the others. So, no matter how many matches there
+    are, at most `OVERVIEW_BUCKETS` regions are drawn.
+    """
+    levels = [ [] for scope in OVERVIEW_SCOPES ]
+
+    if OVERVIEW_BUCKETS and drawn:
+        size = view.size()
+        histograms = [ regions.histogram( size, OVERVIEW_BUCKETS ) for key, regions, scope in drawn ]
+
+        counts = [ sum( column ) for column in zip( *histograms ) ]
+        peak = max( counts )
+
+        for bucket, count in enumerate( counts ):
+            if not count: continue
+
+            begin = state.added_regions[state.added_regions.find( -( -size * bucket // OVERVIEW_BUCKETS ) )][0]
+            levels[( count * len( levels ) - 1 ) // peak].append( view.line( begin ) )
+
+    for level, regions in enumerate( levels ):
+        key = '%s_%d' % ( g_overview_key, level )
+
+        if regions:
+            view.add_regions( key, regions, OVERVIEW_SCOPES[level], 'dot', sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE )
 
-        if all_text.endswith(" "):
-            all_text += view_text
         else:
-            all_text += " %s" % view_text
+            view.erase_regions( key )
+
+
+def show_slow_terms(view, terms):
+    """
+    Show on the status bar which regex terms were skipped for not finishing on their time budget,
+    and that without `parallel_scan_python` they are only stopped after finishing their scan
+    """
+    if terms:
+        view.set_status( g_slow_status_key, "Skipped slow regex: %s%s" % ( ' '.join( terms ),
+                "" if PARALLEL_SCAN_PYTHON else " (set parallel_scan_python to interrupt them)" ) )
+
     else:
-        all_text = settings.get('highlight_text', '')
-    return all_text or ""
+        view.erase_status( g_slow_status_key )
 
 
-class HighlightKeywordsCommand(sublime_plugin.EventListener):
-    is_running = False
-    running_time = 0.1
-    instance = None
+def get_file_key(view):
+    """ Return the `(path, mtime, size)` of the view file if the disk cache is enabled and the view is saved """
+    path = view.file_name()
+    if not DISK_CACHE_SIZE or not path or view.is_dirty() or not sublime.cache_path(): return None
 
-    def __new__(cls):
-        if cls.instance is None:
-            cls.instance = super(HighlightKeywordsCommand, cls).__new__(cls)
-            cls.instance.__initialized = False
-        return cls.instance
+    try:
+        stat = os.stat( path )
 
-    def __init__(self):
-        if(self.__initialized):
-            return
-        self.__initialized = True
+    except OSError:
+        return None
+
+    return ( path, stat.st_mtime, stat.st_size )
+
+
+def get_disk_cache_path(file_key, kind, query):
+    key = repr( ( file_key, kind, query ) )
+    name = hashlib.sha1( key.encode( 'utf-8' ) ).hexdigest() + '.bin'
+    return key, os.path.join( sublime.cache_path(), 'HighlightWords', name )
+
+
+def is_buffer_highlighted(view):
+    """ Whether a view of the buffer was already highlighted by this session """
+    buffer_id = view.buffer_id()
+    return ( buffer_id, 'words' ) in g_buffer_results or ( buffer_id, 'keywords' ) in g_buffer_results
+
+
+def apply_disk_results(highlighter, file_key, words_query, cancelled):
+    """ Publish the highlights stored on the disk cache for the view file, returning whether there were any """
+    view = highlighter.view
+    keywords = load_disk_results( file_key, 'keywords', KEYWORDS_KEY )
+    words = load_disk_results( file_key, 'words', words_query )
+
+    if keywords is None and words is None:
+        return False
 
-    def on_activated(self, view):
-        self.on_modified(view)
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+    navigation = state.index_regions( words or [] )
 
-    def on_modified(self, view):
-        stamp = time.time()
-        self.stamp = stamp
-        threading.Thread( target=delayedFix, args=(self, stamp) ).start()
+    highlighter.publish( cancelled,
+            functools.partial( draw_keywords, view, keywords or [] ),
+            functools.partial( draw_highlights, view, words or [], navigation ) )
+
+    return True
+
+
+def load_disk_results(file_key, kind, query):
+    """
+    Read the `(key, regions, scope)` highlights stored by `save_disk_results()`, or None when there
+    are not any. The file has a JSON header with the keys, scopes and sizes of the regions, followed
+    by their arrays of begins and ends, which are read from a memory map of it.
+    """
+    key, path = get_disk_cache_path( file_key, kind, query )
+
+    try:
+        with open( path, 'rb' ) as file:
+            memory = mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ )
+
+        try:
+            header_size = struct.unpack_from( '<I', memory, 4 )[0]
+            header = json.loads( memory[8:8 + header_size].decode( 'utf-8' ) )
+
+            if memory[:4] != b'HWR1' or header['key'] != key or header['itemsize'] != array.array( 'l' ).itemsize:
+                return None
+
+            drawn = []
+            offset = 8 + header_size
+
+            for region_key, scope, count in header['entries']:
+                regions = Regions()
+                size = count * header['itemsize']
+
+                regions.begins.frombytes( memory[offset:offset + size] )
+                regions.ends.frombytes( memory[offset + size:offset + size * 2] )
+
+                offset += size * 2
+                drawn.append( ( region_key, regions, scope ) )
+
+            # a truncated file, or one written by another version
+            if offset != len( memory ):
+                return None
+
+        finally:
+            memory.close()
+
+        # the eviction removes the least recently used files first
+        os.utime( path, None )
+        return drawn
+
+    except ( OSError, ValueError, KeyError, struct.error ):
+        return None
+
+
+def save_disk_results(file_key, kind, query, drawn):
+    """ Store the `(key, regions, scope)` highlights of the file for `load_disk_results()` """
+    key, path = get_disk_cache_path( file_key, kind, query )
+    if os.path.exists( path ): return
+
+    header = json.dumps( {
+            'key': key,
+            'itemsize': array.array( 'l' ).itemsize,
+            'entries': [ [ region_key, scope, len( regions ) ] for region_key, regions, scope in drawn ],
+        } ).encode( 'utf-8' )
+
+    try:
+        directory = os.path.dirname( path )
+        if not os.path.isdir( directory ): os.makedirs( directory )
+
+        with open( path + '.tmp', 'wb' ) as file:
+            file.write( b'HWR1' + struct.pack( '<I', len( header ) ) + header )
+
+            for region_key, regions, scope in drawn:
+                file.write( regions.begins.tobytes() )
+                file.write( regions.ends.tobytes() )
+
+        os.replace( path + '.tmp', path )
+        evict_disk_results( directory )
+
+    except OSError:
+        log.exception( "Could not save the highlights cache %s" % path )
+
+
+def evict_disk_results(directory):
+    """ Remove the least recently used files of the disk cache while it is larger than `DISK_CACHE_SIZE` """
+    files = []
+
+    for name in os.listdir( directory ):
+        stat = os.stat( os.path.join( directory, name ) )
+        files.append( ( stat.st_mtime, stat.st_size, name ) )
+
+    total = sum( size for mtime, size, name in files )
+
+    for mtime, size, name in sorted( files ):
+        if total <= DISK_CACHE_SIZE: break
+
+        os.remove( os.path.join( directory, name ) )
+        total -= size
+
+
+def get_view_highlight_text(view):
+    """ Return the window highlight text, and it merged with the view one """
+    window = view.window() or sublime.active_window()
+
+    return merge_query( SETTINGS.get('highlight_text', '') or '', window.settings().get('highlight_text', '') or '',
+            view.settings().get('highlight_text', '') or '', USE_REGEX, IGNORE_CASE, WHOLE_WORD )
+
+
+def is_highlighted(view):
+    """ Whether the view buffer has not changed since it was highlighted, with the same settings """
+    return apply_cached_results( view, 'keywords', get_keywords_key( view ) ) \
+            and apply_cached_results( view, 'words', get_results_key( view, get_view_highlight_text( view )[1] ) )
+
+
+def activate_view(view):
+    """ Highlight the view, unless it is already highlighted for its buffer and query """
+    if is_highlighted( view ): return
+    modify_view( view )
+
+
+def load_view(view):
+    if HIGHLIGHT_ALL_VIEWS and view.window():
+        g_background_pool.schedule( view.id(), ( True, ), functools.partial( highlight_in_background, view ) )
+
+
+def modify_view(view):
+    """ Highlight the view on its own scheduler, after a delay growing with how long its last pass took """
+    state = g_view_selections.setdefault( view.id(), Data( view ) )
+    delay = 0.1 + state.timings.last( 'total', 0.1 ) * 2
+    state.scheduler.schedule( 'modified', functools.partial( delayedFix, view ), delay )
+
+
+if hasattr( sublime_plugin, 'ViewEventListener' ):
+
+    class HighlightKeywordsCommand(sublime_plugin.ViewEventListener):
+        """
+        Highlight each view when it is activated or modified, from the async thread, so a slow view
+        does not delay the events of the others, which are scheduled on their own threads.
+        """
+
+        @classmethod
+        def is_applicable(cls, settings):
+            # the input panels are highlighted by `HighlightWordsCommand.on_change()`
+            return not settings.get( 'is_widget' )
+
+        def on_activated_async(self):
+            activate_view( self.view )
+
+        def on_load_async(self):
+            load_view( self.view )
+
+        def on_modified_async(self):
+            modify_view( self.view )
+
+else:
+
+    class HighlightKeywordsCommand(sublime_plugin.EventListener):
+
+        def on_activated(self, view):
+            if not view.settings().get( 'is_widget' ):
+                activate_view( view )
+
+        def on_load(self, view):
+            load_view( view )
+
+        def on_modified(self, view):
+            if not view.settings().get( 'is_widget' ):
+                modify_view( view )
 
 
 def get_settings():
@@ -649,9 +2594,29 @@ def get_settings():
     global UNDER_THE_CURSOR
     global CLEAR_ON_ESCAPE
     global FILE_SIZE_LIMIT
+    global LAZY_CHUNK_SIZE
+    global INCREMENTAL_MARGIN
+    global TIMINGS_SAMPLES
+    global RESULTS_PAGE_SIZE
+    global HIGHLIGHT_ALL_VIEWS
+    global BACKGROUND_WORKERS
+    global DISK_CACHE_SIZE
+    global PARALLEL_SCAN_SIZE
+    global PARALLEL_SCAN_PROCESSES
+    global PARALLEL_SCAN_PYTHON
+    global REGEX_TIME_BUDGET
+    global HIGHLIGHT_TEXT_SAVE_INTERVAL
+    global SHOW_MATCH_COUNTS
+    global OVERVIEW_BUCKETS
+    global TERM_REGION_BUDGET
+    global TOTAL_REGION_BUDGET
+    global HIGHLIGHT_CAPTURED_OCCURRENCES
     global SCOPES
     global KEYWORD_MAP
+    global KEYWORD_TERMS
     global ACTIVE_SELECTION_WORD
+    global SETTINGS_KEY
+    global KEYWORDS_KEY
 
     SETTINGS = sublime.load_settings('HighlightWords.sublime-settings')
     USE_REGEX = SETTINGS.get('use_regex', False)
@@ -660,16 +2625,62 @@ def get_settings():
     UNDER_THE_CURSOR = SETTINGS.get('under_the_cursor', True)
     CLEAR_ON_ESCAPE = SETTINGS.get('clear_on_escape', False)
     FILE_SIZE_LIMIT = SETTINGS.get('file_size_limit', 4194304)
+    LAZY_CHUNK_SIZE = SETTINGS.get('lazy_chunk_size', 262144)
+    INCREMENTAL_MARGIN = SETTINGS.get('incremental_rescan_margin', 1024)
+    TIMINGS_SAMPLES = SETTINGS.get('timings_samples', 100)
+    RESULTS_PAGE_SIZE = SETTINGS.get('results_page_size', 1000)
+    HIGHLIGHT_ALL_VIEWS = SETTINGS.get('highlight_all_views', False)
+    BACKGROUND_WORKERS = SETTINGS.get('background_workers', 2)
+    DISK_CACHE_SIZE = SETTINGS.get('disk_cache_size', 0)
+    REGEX_TIME_BUDGET = SETTINGS.get('regex_time_budget', 1.0)
+    HIGHLIGHT_TEXT_SAVE_INTERVAL = SETTINGS.get('highlight_text_save_interval', 5)
+    SHOW_MATCH_COUNTS = SETTINGS.get('show_match_counts', True)
+    OVERVIEW_BUCKETS = SETTINGS.get('overview_buckets', 0)
+    TERM_REGION_BUDGET = SETTINGS.get('term_region_budget', 50000)
+    TOTAL_REGION_BUDGET = SETTINGS.get('total_region_budget', 200000)
+    HIGHLIGHT_CAPTURED_OCCURRENCES = SETTINGS.get('highlight_captured_occurrences', False)
+
+    parallel_settings = ( PARALLEL_SCAN_SIZE, PARALLEL_SCAN_PROCESSES, PARALLEL_SCAN_PYTHON )
+    PARALLEL_SCAN_SIZE = SETTINGS.get('parallel_scan_size', 0)
+    PARALLEL_SCAN_PROCESSES = SETTINGS.get('parallel_scan_processes', 0)
+    PARALLEL_SCAN_PYTHON = SETTINGS.get('parallel_scan_python', "")
+
+    if parallel_settings != ( PARALLEL_SCAN_SIZE, PARALLEL_SCAN_PROCESSES, PARALLEL_SCAN_PYTHON ):
+        shutdown_process_pool()
     SCOPES = SETTINGS.get('colors_by_scope', SCOPES)
     KEYWORD_MAP = SETTINGS.get('permanent_highlight_keyword_color_mappings', [])
     ACTIVE_SELECTION_WORD = SETTINGS.get('active_selection_word', "comment")
+
+    SETTINGS_KEY = ( USE_REGEX, IGNORE_CASE, WHOLE_WORD, FILE_SIZE_LIMIT, HIGHLIGHT_CAPTURED_OCCURRENCES, tuple( SCOPES ) )
+    keywords_key, KEYWORDS_KEY = KEYWORDS_KEY, repr( KEYWORD_MAP )
+
+    # compile the permanent keywords once, for all passes, e.g., not when only `highlight_text` changed
+    if keywords_key == KEYWORDS_KEY:
+        return SETTINGS
+
+    KEYWORD_TERMS = []
+    word_set = set()
+
+    for pair in KEYWORD_MAP:
+        word = pair.get('keyword')
+        color = pair.get('color')
+        flag = pair.get('flag', sublime.LITERAL)
+
+        if word and color and word not in word_set:
+            word_set.add(word)
+            KEYWORD_TERMS.append( ( word, term_pattern( word, flag ), color, flag ) )
+
     return SETTINGS
 
 def plugin_loaded():
     get_settings().add_on_change(g_regionkey, get_settings)
 
+    if HIGHLIGHT_ALL_VIEWS:
+        sublime.set_timeout( lambda: highlight_all_views( sublime.windows() ), 0 )
+
 def plugin_unloaded():
     get_settings().clear_on_change(g_regionkey)
+    shutdown_process_pool()
 
 if not ST3:
     plugin_loaded()
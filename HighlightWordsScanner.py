@@ -0,0 +1,382 @@
+"""
+The pure Python scanning of the highlighted words. It does not import `sublime`, so the processes
+of the parallel scanning pool can import it to unpickle the matchers and run `scan_text()`.
+"""
+import re
+import time
+import array
+import bisect
+import itertools
+
+# the least number of case sensitive literals joined on an alternation, as fewer ones are found
+# faster by themselves
+COMBINED_LITERALS = 64
+
+# how many leading characters of the alternation literals are factored on a trie
+TRIE_DEPTH = 32
+
+
+class Regions(object):
+    """
+    A compact sorted list of `(begin, end)` regions, optionally with the index of the `term` which
+    matched each one, stored as columns of integers instead of a tuple per region.
+    """
+    __slots__ = ( 'begins', 'ends', 'terms' )
+
+    def __init__(self, regions=()):
+        self.begins = array.array( 'l' )
+        self.ends = array.array( 'l' )
+        self.terms = array.array( 'l' )
+
+        for region in regions:
+            self.append( *region )
+
+    def append(self, begin, end, term=None):
+        self.begins.append( begin )
+        self.ends.append( end )
+
+        if term is not None:
+            self.terms.append( term )
+
+    def extend(self, regions):
+        self.begins.extend( regions.begins )
+        self.ends.extend( regions.ends )
+        self.terms.extend( regions.terms )
+
+    def slice(self, start, end=None, delta=0):
+        """ Return the regions from the index `start` until `end`, shifted by `delta` """
+        regions = Regions()
+        regions.terms = self.terms[start:end]
+
+        if delta:
+            regions.begins.extend( begin + delta for begin in self.begins[start:end] )
+            regions.ends.extend( end + delta for end in self.ends[start:end] )
+
+        else:
+            regions.begins = self.begins[start:end]
+            regions.ends = self.ends[start:end]
+
+        return regions
+
+    def find(self, point, start=0):
+        """ Return the index of the first region beginning at or after `point` """
+        return bisect.bisect_left( self.begins, point, start )
+
+    def items(self):
+        return zip( self.begins, self.ends, self.terms )
+
+    def histogram(self, size, buckets):
+        """ Return how many regions begin on each of the `buckets` equal parts of a text with `size` characters """
+        counts = []
+        start = 0
+
+        for bucket in range( 1, buckets + 1 ):
+            end = bisect.bisect_left( self.begins, -( -size * bucket // buckets ), start )
+            counts.append( end - start )
+            start = end
+
+        return counts
+
+    def __len__(self):
+        return len( self.begins )
+
+    def __getitem__(self, index):
+        return self.begins[index], self.ends[index]
+
+    def __iter__(self):
+        return zip( self.begins, self.ends )
+
+    def __eq__(self, other):
+        return isinstance( other, Regions ) and self.begins == other.begins and self.ends == other.ends and self.terms == other.terms
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Matcher(object):
+    """
+    Scan the text once for several `(term, pattern)` pairs by joining them on a single alternation.
+    Only the literal terms which cannot overlap each other share one, see `create()`, so it finds
+    the same matches as scanning for each term by itself.
+
+    The alternatives are not wrapped on capturing groups because they disable the `re` module
+    literal prefix optimizations, making the scan several times slower. Instead, each match is
+    attributed to its term by looking up its text on the literal terms.
+    """
+
+    def __init__(self, term_patterns):
+        self.key = tuple( ( term, pattern.pattern, pattern.flags ) for term, pattern in term_patterns )
+        self.ignore_case = term_patterns[0][1].flags & re.IGNORECASE
+        literals = [ get_word_literal( pattern.pattern ) for term, pattern in term_patterns ]
+        self.is_literal = None not in literals
+        self.max_length = max( len( literal ) for literal in literals ) if self.is_literal else None
+
+        if len( term_patterns ) == 1:
+            self.pattern = term_patterns[0][1]
+            self.literals = None
+            return
+
+        self.literals = {}
+        self.patterns = [ pattern for term, pattern in term_patterns ]
+
+        for term, (word, pattern) in enumerate( term_patterns ):
+            self.literals[self.fold( get_word_literal( pattern.pattern ) )] = term
+
+        self.pattern = re.compile( join_literals( [ pattern.pattern for term, pattern in term_patterns ] ),
+                term_patterns[0][1].flags )
+
+    def terms(self):
+        return [ key[0] for key in self.key ]
+
+    def split(self):
+        """ Return one matcher for each term of this one """
+        return [ Matcher( [ ( term, re.compile( source, flags ) ) ] ) for term, source, flags in self.key ]
+
+    def fold(self, text):
+        return text.lower() if self.ignore_case else text
+
+    @staticmethod
+    def is_combinable(pattern):
+        """ Whether the pattern only matches a literal text, which means the same inside an alternation """
+        literal = get_word_literal( pattern.pattern )
+        return bool( literal ) and not pattern.groupindex
+
+    @classmethod
+    def create(cls, term_patterns):
+        """
+        Group the `(term, pattern)` pairs on the least number of matchers possible. An alternation
+        only reports one of the matches which overlap, so the literals which may overlap, e.g.,
+        `ab` and `bc`, or `foo` and `foobar`, are put on different matchers, as are the other
+        regular expressions, which are not known to never overlap.
+
+        A case sensitive literal not beginning with `\\b` is found faster by itself, with the `re`
+        module literal prefix search, than inside an alternation, so these are only joined when
+        there are at least `COMBINED_LITERALS` of them.
+        """
+        buckets = {}
+        matchers = []
+
+        for index, item in enumerate( term_patterns ):
+            # only the patterns with the same flags can share an alternation
+            if cls.is_combinable( item[1] ):
+                buckets.setdefault( item[1].flags, [] ).append( index )
+
+            else:
+                matchers.append( ( index, [item] ) )
+
+        for flags, indexes in buckets.items():
+            plain = [ index for index in indexes if not term_patterns[index][1].pattern.startswith( '\\b' ) ]
+
+            if not flags & re.IGNORECASE and len( plain ) < COMBINED_LITERALS:
+                matchers.extend( ( index, [ term_patterns[index] ] ) for index in plain )
+                indexes = [ index for index in indexes if term_patterns[index][1].pattern.startswith( '\\b' ) ]
+
+            literals = [ get_word_literal( term_patterns[index][1].pattern ) for index in indexes ]
+            literals = [ literal.lower() for literal in literals ] if flags & re.IGNORECASE else literals
+
+            for group in group_literals( literals ):
+                items = sorted( indexes[position] for position in group )
+                matchers.append( ( items[0], [ term_patterns[index] for index in items ] ) )
+
+        return [ cls( items ) for index, items in sorted( matchers, key=lambda matcher: matcher[0] ) ]
+
+    def finditer(self, text, start=0, offset=0):
+        """
+        Yield the `(begin, end, term)` matches from `start` on the `text`, which begins at the buffer
+        `offset`, where `term` is the index of the matched one on `terms()`
+        """
+        literals = self.literals
+
+        for match in self.pattern.finditer( text, start - offset ):
+            begin, end = match.span()
+
+            if end > begin:
+                yield begin + offset, end + offset, self.find_term( text, match ) if literals else 0
+
+    def find_term(self, text, match):
+        """ Find which alternative the alternation picked for `match` """
+        term = self.literals.get( self.fold( match.group() ) )
+        if term is not None: return term
+
+        # e.g., a case insensitive match whose lower case differs from the term one
+        for term, pattern in enumerate( self.patterns ):
+            if pattern.match( text, match.start() ): return term
+
+
+def get_literal(source):
+    """ Return the text matched by the regex `source`, or None if it has any special character """
+    if re.search( r'\\[a-zA-Z0-9]|(?<!\\)[.^$*+?{}\[\]|()]', source ):
+        return None
+
+    return re.sub( r'\\(.)', r'\1', source, flags=re.DOTALL )
+
+
+def get_word_literal(source):
+    """ Return the text matched by the regex `source`, optionally between word boundaries, or None """
+    return get_literal( re.sub( r'^\\b|(?<!\\)\\b$', '', source ) )
+
+
+def get_word_tokens(source):
+    """ Return the regex tokens of the literal `source`: its escaped characters between the optional `\\b` """
+    tokens = [ re.escape( character ) for character in get_word_literal( source ) ]
+
+    if source.startswith( '\\b' ):
+        tokens.insert( 0, '\\b' )
+
+    if re.search( r'(?<!\\)\\b$', source[2:] if source.startswith( '\\b' ) else source ):
+        tokens.append( '\\b' )
+
+    return tokens
+
+
+def join_literals(sources):
+    """
+    Return an alternation of the literal regex `sources`, factoring their common prefixes on a trie,
+    e.g., `foo(?:bar|baz)`, so the `re` module does not try every alternative at each position
+    """
+    trie = {}
+
+    for source in sources:
+        tokens = get_word_tokens( source )
+        node = trie
+
+        # bounded, so the nested groups do not exhaust the `re` compiler recursion
+        for token in tokens[:TRIE_DEPTH]:
+            node = node.setdefault( token, {} )
+
+        node.setdefault( None, [] ).append( ''.join( tokens[TRIE_DEPTH:] ) )
+
+    return get_trie_source( trie )
+
+
+def get_trie_source(node):
+    alternatives = [ token + get_trie_source( node[token] ) for token in sorted( token for token in node if token is not None ) ]
+    alternatives.extend( node.get( None, () ) )
+    return alternatives[0] if len( alternatives ) == 1 else '(?:%s)' % '|'.join( alternatives )
+
+
+def group_literals(literals):
+    """
+    Return the lists of indexes of the `literals` which cannot overlap each other, e.g., `ab` and `bc`,
+    or `foo` and `foobar`. Each literal is compared to the shorter ones already grouped through hash
+    tables of their texts, prefixes and suffixes, instead of to every other literal.
+    """
+    groups = []
+    lengths = set()
+    by_literal = {}
+    by_prefix = {}
+    by_suffix = {}
+
+    for index in sorted( range( len( literals ) ), key=lambda index: len( literals[index] ) ):
+        literal = literals[index]
+        size = len( literal )
+        blocked = set()
+
+        # a shorter or equal literal inside this one
+        for length in lengths:
+            for begin in range( size - length + 1 ):
+                blocked.update( by_literal.get( literal[begin:begin + length], () ) )
+
+        # this one ending with the beginning of another, or beginning with the ending of another
+        for length in range( 1, size ):
+            blocked.update( by_prefix.get( literal[-length:], () ) )
+            blocked.update( by_suffix.get( literal[:length], () ) )
+
+        group = next( ( group for group in range( len( groups ) ) if group not in blocked ), len( groups ) )
+
+        if group == len( groups ):
+            groups.append( [] )
+
+        groups[group].append( index )
+        lengths.add( size )
+        by_literal.setdefault( literal, set() ).add( group )
+
+        for length in range( 1, size ):
+            by_prefix.setdefault( literal[:length], set() ).add( group )
+            by_suffix.setdefault( literal[-length:], set() ).add( group )
+
+    return groups
+
+
+def regions_before(matches, end, text_end, complete):
+    """
+    Return the `(begin, end, term)` matches beginning before `end`, without the ones touching the
+    `text_end`, which may have been cut by it, unless the text is `complete`.
+    """
+    return Regions( itertools.takewhile( lambda region: region[0] < end and ( complete or region[1] < text_end ), matches ) )
+
+
+def scan_text(matcher, text, offset, begin, end, complete):
+    """ Return the regions `matcher` finds beginning from `begin` until `end` on the `text`, which begins at the buffer `offset` """
+    return regions_before( matcher.finditer( text, begin, offset ), end, offset + len( text ), complete )
+
+
+class TimeBudgetExceeded(Exception):
+    """ Raised when a regular expression does not finish scanning before its deadline """
+
+
+class ScanCancelled(Exception):
+    """ Raised when a newer highlighting pass cancelled the one scanning """
+
+
+class SearchMatch(object):
+    """ The spans and groups of a `/regex/` search match, which unlike the `re` ones can be pickled """
+    __slots__ = ( 'regs', 'captured', 'offset' )
+
+    def __init__(self, match, offset=0):
+        self.regs = match.regs
+        self.captured = match.groups()
+        self.offset = offset
+
+    def groups(self):
+        return self.captured
+
+    def span(self, group=0):
+        begin, end = self.regs[group]
+
+        # the groups which did not participate have no position to shift
+        return ( begin + self.offset, end + self.offset ) if end >= 0 else ( begin, end )
+
+
+def until_deadline(matches, deadline, cancelled=None):
+    """
+    Yield the `matches`, raising TimeBudgetExceeded when the `deadline` passed between them, or
+    ScanCancelled when `cancelled()`
+    """
+    for match in matches:
+
+        if time.time() > deadline:
+            raise TimeBudgetExceeded()
+
+        if cancelled is not None and cancelled():
+            raise ScanCancelled()
+
+        yield match
+
+    # the last match, or the search after it, may have taken past it
+    if time.time() > deadline:
+        raise TimeBudgetExceeded()
+
+
+def scan_until(matcher, text, deadline, cancelled=None):
+    """ Return the regions `matcher` finds on the whole `text`, unless it takes past the `deadline` or is `cancelled()` """
+    return Regions( until_deadline( matcher.finditer( text ), deadline, cancelled ) )
+
+
+def search_until(pattern, text, deadline, cancelled=None):
+    """ Return the `SearchMatch` of each `pattern` match on the `text`, unless it takes past the `deadline` or is `cancelled()` """
+    return [ SearchMatch( match ) for match in until_deadline( pattern.finditer( text ), deadline, cancelled ) ]
+
+
+def search_window(pattern, text, offset, begin, end, complete, deadline, cancelled=None):
+    """
+    Return the `SearchMatch` of each `pattern` match beginning from `begin` until `end` on the `text`,
+    which begins at the buffer `offset`, without the ones touching its end, unless it is `complete`
+    """
+    matches = []
+
+    for match in until_deadline( pattern.finditer( text, begin - offset ), deadline, cancelled ):
+        if match.start() + offset >= end or not complete and match.end() >= len( text ): break
+        matches.append( SearchMatch( match, offset ) )
+
+    return matches
@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+####################### Licensing #######################################################
+#
+#   Copyright 2018 @ Evandro Coan
+#   Highlight Pipeline Benchmarks
+#
+#  Redistributions of source code must retain the above
+#  copyright notice, this list of conditions and the
+#  following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above
+#  copyright notice, this list of conditions and the following
+#  disclaimer in the documentation and/or other materials
+#  provided with the distribution.
+#
+#  Neither the name Evandro Coan nor the names of any
+#  contributors may be used to endorse or promote products
+#  derived from this software without specific prior written
+#  permission.
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or ( at
+#  your option ) any later version.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################################
+#
+
+"""
+Benchmark the HighlightWords pipeline outside Sublime Text, using the fake `sublime` and
+`sublime_plugin` modules from this directory. The `pushdown` and `debug_tools` dependencies must
+be installed. Each measurement is printed as a JSON line, e.g.:
+
+    python tests/benchmarks/run_benchmarks.py --sizes 10K 1M --terms 1 10 50 --output results.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+import tracemalloc
+
+BENCHMARKS_DIRECTORY = os.path.dirname( os.path.realpath( __file__ ) )
+PACKAGE_ROOT_DIRECTORY = os.path.dirname( os.path.dirname( BENCHMARKS_DIRECTORY ) )
+
+sys.path.insert( 0, BENCHMARKS_DIRECTORY )
+sys.path.insert( 1, os.path.dirname( PACKAGE_ROOT_DIRECTORY ) )
+
+import sublime
+
+# imported as a package module, like Sublime Text does, for its relative imports
+HighlightWords = importlib.import_module( os.path.basename( PACKAGE_ROOT_DIRECTORY ) + '.HighlightWords' )
+
+MODES = {
+    'literal': { 'use_regex': False, 'ignore_case': False },
+    'regex': { 'use_regex': True, 'ignore_case': False },
+    'ignore_case': { 'use_regex': False, 'ignore_case': True },
+}
+
+SIZE_SUFFIXES = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3 }
+
+
+def parse_size(size):
+    suffix = size[-1:].upper()
+
+    if suffix in SIZE_SUFFIXES:
+        return int( float( size[:-1] ) * SIZE_SUFFIXES[suffix] )
+
+    return int( size )
+
+
+def generate_text(size, seed=1):
+    """ Build `size` characters of lines with words from a fixed vocabulary """
+    generator = random.Random( seed )
+    words = [ 'word%d' % index for index in range( 1000 ) ] + [ 'the', 'id', 'value', 'error', 'return' ]
+
+    lines = []
+    block_size = 0
+
+    while block_size < min( size, 1024 ** 2 ):
+        line = ' '.join( generator.choice( words ) for index in range( generator.randint( 1, 16 ) ) )
+        lines.append( line )
+        block_size += len( line ) + 1
+
+    block = '\n'.join( lines ) + '\n'
+    return ( block * ( size // len( block ) + 1 ) )[:size]
+
+
+def get_query(mode, terms):
+    words = [ 'word%d' % ( index * 7 ) for index in range( terms ) ]
+
+    if mode == 'regex':
+        words = [ r'\b%s\d?\b' % word for word in words ]
+
+    return ' '.join( words )
+
+
+def configure(mode, arguments):
+    settings = sublime.load_settings( 'HighlightWords.sublime-settings' )
+    settings.set( 'file_size_limit', arguments.file_size_limit )
+    settings.set( 'parallel_scan_size', arguments.parallel_scan_size )
+    settings.set( 'parallel_scan_python', sys.executable if arguments.parallel_scan_size else '' )
+
+    for key, value in MODES[mode].items():
+        settings.set( key, value )
+
+    HighlightWords.get_settings()
+
+
+def measure(function, repeats):
+    """ Return the best time of `repeats` calls of `function`, plus its peak memory on one more """
+    best = float( 'inf' )
+
+    for index in range( repeats ):
+        start = time.perf_counter()
+        function()
+        best = min( best, time.perf_counter() - start )
+
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak_memory
+
+
+def new_view(text):
+    window = sublime.active_window()
+    view = window.new_file( text )
+
+    HighlightWords.g_view_selections.clear()
+    HighlightWords.g_buffer_results.clear()
+    return view
+
+
+def highlight(view, query):
+    highlighter = HighlightWords.HighlightWordsCommand( view )
+    highlighter.read_text()
+    highlighter.highlight( query )
+
+
+def benchmark_highlight(text, mode, terms, repeats):
+    query = get_query( mode, terms )
+
+    def run():
+        highlight( new_view( text ), query )
+
+    return run
+
+
+def benchmark_edit(text, mode, terms, repeats):
+    """ Highlight again after inserting a word in the middle of the buffer """
+    query = get_query( mode, terms )
+    view = new_view( text )
+    highlight( view, query )
+
+    def run():
+        view.insert_text( view.size() // 2, 'word0 ' )
+        highlight( view, query )
+
+    return run
+
+
+def benchmark_get_words(text, mode, terms, repeats):
+    query = get_query( mode, terms )
+    highlighter = HighlightWords.HighlightWordsCommand( new_view( text ) )
+    highlighter.read_text()
+
+    def run():
+        HighlightWords.parse_query.cache_clear()
+        highlighter.get_words( query, skip_search=False )
+
+    return run
+
+
+def benchmark_navigation(text, mode, terms, repeats, steps=1000):
+    """ Jump the caret around and select the next and previous highlighted words """
+    view = new_view( text )
+    highlight( view, get_query( mode, terms ) )
+
+    state = HighlightWords.g_view_selections[view.id()]
+    generator = random.Random( 1 )
+
+    def run():
+        for index in range( steps ):
+            view.sel()[:] = [ sublime.Region( generator.randint( 0, view.size() ) ) ]
+            if state.added_regions: state.target_points( backwards=index % 2 == 1 )
+
+    return run
+
+
+BENCHMARKS = {
+    'highlight': benchmark_highlight,
+    'edit': benchmark_edit,
+    'get_words': benchmark_get_words,
+    'navigation': benchmark_navigation,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__.strip().split( '\n\n' )[0] )
+    parser.add_argument( '--benchmarks', nargs='+', default=sorted( BENCHMARKS ), choices=sorted( BENCHMARKS ) )
+    parser.add_argument( '--sizes', nargs='+', default=[ '10K', '100K', '1M', '10M', '50M' ] )
+    parser.add_argument( '--terms', nargs='+', type=int, default=[ 1, 10, 50 ] )
+    parser.add_argument( '--modes', nargs='+', default=sorted( MODES ), choices=sorted( MODES ) )
+    parser.add_argument( '--repeats', type=int, default=3 )
+    parser.add_argument( '--file-size-limit', type=parse_size, default=4194304,
+            help='Buffers larger than this are highlighted lazily by chunks' )
+    parser.add_argument( '--parallel-scan-size', type=parse_size, default=0,
+            help='Scan buffers from this size on with a process pool, 0 disables it' )
+    parser.add_argument( '--output', help='Append the results to this file instead of printing them' )
+    arguments = parser.parse_args()
+
+    HighlightWords.plugin_loaded()
+    output = open( arguments.output, 'a' ) if arguments.output else sys.stdout
+
+    try:
+        for size in arguments.sizes:
+            text = generate_text( parse_size( size ) )
+
+            for mode in arguments.modes:
+                configure( mode, arguments )
+
+                for terms in arguments.terms:
+                    for name in arguments.benchmarks:
+                        seconds, peak_memory = measure( BENCHMARKS[name]( text, mode, terms, arguments.repeats ), arguments.repeats )
+
+                        output.write( json.dumps( {
+                                'benchmark': name,
+                                'mode': mode,
+                                'size': len( text ),
+                                'terms': terms,
+                                'parallel_scan_size': arguments.parallel_scan_size,
+                                'seconds': seconds,
+                                'megabytes_per_second': len( text ) / 1024 ** 2 / seconds if seconds else None,
+                                'peak_memory_bytes': peak_memory,
+                            }, sort_keys=True ) + '\n' )
+                        output.flush()
+
+    finally:
+        HighlightWords.plugin_unloaded()
+
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
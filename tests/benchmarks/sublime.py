@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A fake `sublime` module implementing the parts of the API used by HighlightWords over plain python
+strings, so its highlight pipeline can be benchmarked outside Sublime Text.
+"""
+
+import re
+
+LITERAL = 1
+IGNORECASE = 2
+
+DRAW_EMPTY = 1
+HIDE_ON_MINIMAP = 2
+DRAW_EMPTY_AS_OVERWRITE = 4
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+
+HIDDEN = 128
+
+_settings = {}
+_windows = []
+
+
+def version():
+    return '4000'
+
+
+def set_timeout(callback, delay=0):
+    callback()
+
+
+def set_timeout_async(callback, delay=0):
+    callback()
+
+
+def status_message(message):
+    pass
+
+
+def load_settings(name):
+    return _settings.setdefault( name, Settings() )
+
+
+def save_settings(name):
+    pass
+
+
+def cache_path():
+    return None
+
+
+def windows():
+    return list( _windows )
+
+
+def active_window():
+    if not _windows:
+        _windows.append( Window() )
+    return _windows[0]
+
+
+class Region(object):
+    __slots__ = ( 'a', 'b' )
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min( self.a, self.b )
+
+    def end(self):
+        return max( self.a, self.b )
+
+    def size(self):
+        return abs( self.b - self.a )
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, point):
+        return self.begin() <= point <= self.end()
+
+    def intersects(self, other):
+        return self.begin() < other.end() and other.begin() < self.end()
+
+    def __eq__(self, other):
+        return isinstance( other, Region ) and self.begin() == other.begin() and self.end() == other.end()
+
+    def __repr__(self):
+        return '(%d, %d)' % ( self.a, self.b )
+
+
+class Settings(object):
+
+    def __init__(self):
+        self.values = {}
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return self.values.get( key, default )
+
+    def set(self, key, value):
+        self.values[key] = value
+
+        for callback in list( self.callbacks.values() ):
+            callback()
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop( key, None )
+
+    def add_on_change(self, tag, callback):
+        self.callbacks[tag] = callback
+
+    def clear_on_change(self, tag):
+        self.callbacks.pop( tag, None )
+
+
+class Selection(list):
+
+    def add(self, region):
+        self.append( region )
+
+
+class Buffer(object):
+    _ids = 0
+
+    def __init__(self, text):
+        Buffer._ids += 1
+        self._id = Buffer._ids
+        self.text = text
+        self.change_count = 0
+        self.views = []
+
+
+class View(object):
+    _ids = 0
+
+    def __init__(self, text='', window=None, buffer=None):
+        View._ids += 1
+        self._id = View._ids
+        self._window = window
+        self._buffer = buffer or Buffer( text )
+        self._buffer.views.append( self )
+        self._settings = Settings()
+        self._selection = Selection( [ Region( 0 ) ] )
+        self._viewport = ( 0, 4096 )
+        self.regions = {}
+        self.status = {}
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._buffer._id
+
+    def change_count(self):
+        return self._buffer.change_count
+
+    def window(self):
+        return self._window
+
+    def settings(self):
+        return self._settings
+
+    def sel(self):
+        return self._selection
+
+    def size(self):
+        return len( self._buffer.text )
+
+    def substr(self, region):
+        if isinstance( region, int ):
+            return self._buffer.text[region:region + 1]
+        return self._buffer.text[region.begin():region.end()]
+
+    def find_all(self, pattern, flags=0, format=None, extractions=None):
+        if flags & LITERAL:
+            pattern = re.escape( pattern )
+
+        flags = re.MULTILINE | ( re.IGNORECASE if flags & IGNORECASE else 0 )
+        return [ Region( *match.span() ) for match in re.finditer( pattern, self._buffer.text, flags ) if match.end() > match.start() ]
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        self.regions[key] = list( regions )
+
+    def get_regions(self, key):
+        return list( self.regions.get( key, [] ) )
+
+    def erase_regions(self, key):
+        self.regions.pop( key, None )
+
+    def visible_region(self):
+        return Region( min( self._viewport[0], self.size() ), min( self._viewport[1], self.size() ) )
+
+    def set_viewport(self, begin, end):
+        self._viewport = ( begin, end )
+
+    def show(self, region, show_surrounds=True):
+        if isinstance( region, Region ):
+            self._viewport = ( region.begin(), region.begin() + self._viewport[1] - self._viewport[0] )
+
+    def word(self, region):
+        return region
+
+    def line(self, point):
+        if isinstance( point, Region ):
+            point = point.begin()
+
+        text = self._buffer.text
+        end = text.find( '\n', point )
+        return Region( text.rfind( '\n', 0, point ) + 1, len( text ) if end < 0 else end )
+
+    def rowcol(self, point):
+        text = self._buffer.text
+        return text.count( '\n', 0, point ), point - text.rfind( '\n', 0, point ) - 1
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop( key, None )
+
+    def file_name(self):
+        return None
+
+    def is_loading(self):
+        return False
+
+    def run_command(self, command, args=None):
+        pass
+
+    def insert_text(self, point, text):
+        """ Not the `edit` based API, a shortcut to change the buffer on the benchmarks """
+        buffer = self._buffer
+        buffer.text = buffer.text[:point] + text + buffer.text[point:]
+        buffer.change_count += 1
+
+
+class Window(object):
+    _ids = 0
+
+    def __init__(self):
+        Window._ids += 1
+        self._id = Window._ids
+        self._settings = Settings()
+        self._views = []
+
+    def id(self):
+        return self._id
+
+    def settings(self):
+        return self._settings
+
+    def views(self):
+        return list( self._views )
+
+    def active_view(self):
+        return self._views[-1] if self._views else None
+
+    def num_groups(self):
+        return 1
+
+    def active_view_in_group(self, group):
+        return self.active_view()
+
+    def new_file(self, text=''):
+        view = View( text, self )
+        self._views.append( view )
+        return view
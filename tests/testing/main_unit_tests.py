@@ -36,13 +36,18 @@
 #########################################################################################
 #
 
+import sublime
 import sublime_plugin
 
 import re
 import os
+import array
 import sys
+import shutil
+import tempfile
 
 import unittest
+import unittest.mock
 
 from debug_tools import utilities
 from debug_tools import testing_utilities
@@ -51,6 +56,23 @@ from debug_tools import testing_utilities
 from HighlightWords import HighlightWords
 
 
+class TextView(object):
+    """ The view methods the chunked scan uses, on a plain text scrolled to `visible` """
+
+    def __init__(self, text, visible):
+        self.text = text
+        self.visible = visible
+
+    def size(self):
+        return len( self.text )
+
+    def substr(self, region):
+        return self.text[region.begin():region.end()]
+
+    def visible_region(self):
+        return sublime.Region( self.visible, self.visible )
+
+
 class PushdownUnitTests(testing_utilities.TestingUtilities):
 
     def test_searchAndWord(self):
@@ -75,3 +97,250 @@ class PushdownUnitTests(testing_utilities.TestingUtilities):
             + start  [@1,0:9='var/ /var/'<WORDS>,1:1]
         """,
         tree.pretty(debug=1) )
+
+    def test_parseQueryCache(self):
+        expression = "/(\\w+)=/ word1 word2"
+        hits = HighlightWords.parse_query.cache_info().hits
+
+        query = HighlightWords.parse_query( expression, True, False, False )
+        self.assertEqual( "/(\\w+)=/", query[0][0] )
+        self.assertEqual( [ "word1", "word2" ], list( query[1:] ) )
+
+        self.assertIs( query, HighlightWords.parse_query( expression, True, False, False ) )
+        self.assertEqual( hits + 1, HighlightWords.parse_query.cache_info().hits )
+
+    def test_timingsHistogram(self):
+        timings = HighlightWords.Timings()
+
+        for seconds in ( 0.0005, 0.002, 0.002, 0.5, 2 ):
+            timings.add( 'scan', seconds )
+
+        self.assertEqual( 2, timings.last( 'scan' ) )
+        self.assertEqual( 0.1, timings.last( 'parse', 0.1 ) )
+        self.assertEqual( [ 1, 2, 0, 0, 0, 1, 1 ], timings.histogram( timings.samples['scan'] ) )
+
+        for seconds in range( HighlightWords.TIMINGS_SAMPLES ):
+            timings.add( 'scan', 0 )
+
+        self.assertEqual( HighlightWords.TIMINGS_SAMPLES, len( timings.samples['scan'] ) )
+        self.assertIn( 'scan', timings.report() )
+
+    def test_stableWordSlots(self):
+        state = HighlightWords.Data( None )
+
+        self.assertEqual( [ 0, 1 ], state.assign_slots( [ "word1", "word2" ] ) )
+        self.assertEqual( [ 2, 0, 1 ], state.assign_slots( [ "word3", "word1", "word2" ] ) )
+        self.assertEqual( [ 2, 1 ], state.assign_slots( [ "word3", "word2" ] ) )
+        self.assertEqual( [ 0, 2, 1 ], state.assign_slots( [ "word4", "word3", "word2" ] ) )
+
+    def test_regexTimeBudget(self):
+        matcher = HighlightWords.Matcher( [ ( "a+b?", re.compile( "a+b?" ) ) ] )
+        self.assertEqual( 3, len( HighlightWords.scan_until( matcher, "a ab a", float( 'inf' ) ) ) )
+
+        with self.assertRaises( HighlightWords.TimeBudgetExceeded ):
+            HighlightWords.scan_until( matcher, "a ab a", 0 )
+
+        with self.assertRaises( HighlightWords.ScanCancelled ):
+            HighlightWords.scan_until( matcher, "a ab a", float( 'inf' ), lambda: True )
+
+    def test_mergeRegions(self):
+        regions = HighlightWords.merge_regions( [
+                HighlightWords.Regions( [ ( 10, 12 ) ] ),
+                HighlightWords.Regions( [ ( 2, 5 ), ( 10, 12 ) ] ),
+            ] )
+
+        self.assertEqual( [ ( 2, 5 ), ( 10, 12 ) ], list( regions ) )
+
+    def test_searchEntries(self):
+        command = HighlightWords.HighlightWordsCommand( TextView( "", 0 ) )
+        search = lambda pattern, text: list( re.finditer( pattern, text ) )
+
+        entries = command.get_entries( [ search( r"(?=.*(1))a(?:.*?(1))?", "a1a1a1" ), "ab", search( r"b\d", "b1 b2" ) ] )
+        self.assertEqual( [ ( "1", "1" ), "ab", () ], [ identity for identity, regions in entries ] )
+
+        self.assertEqual( [ ( 1, 2 ), ( 3, 4 ), ( 5, 6 ) ], list( entries[0][1] ) )
+        self.assertEqual( "ab", entries[1][1] )
+        self.assertEqual( [ ( 0, 2 ), ( 3, 5 ) ], list( entries[2][1] ) )
+
+    def test_navigationIndex(self):
+        state = HighlightWords.Data( TextView( "", 0 ) )
+        first = HighlightWords.Regions( [ ( 2, 5 ), ( 10, 12 ) ] )
+        second = HighlightWords.Regions( [ ( 0, 1 ), ( 10, 12 ), ( 20, 22 ) ] )
+
+        navigation = state.index_regions( [ ( "a", first, None ) ] )
+        self.assertEqual( [ ( 2, 5 ), ( 10, 12 ) ], list( navigation[1] ) )
+
+        navigation = state.index_regions( [ ( "a", first, None ), ( "b", second, None ) ] )
+        self.assertEqual( [ ( 0, 1 ), ( 2, 5 ), ( 10, 12 ), ( 20, 22 ) ], list( navigation[1] ) )
+
+        navigation = state.index_regions( [ ( "b", second, None ) ] )
+        self.assertEqual( list( second ), list( navigation[1] ) )
+        self.assertEqual( [], list( state.added_regions ) )
+
+        state.set_regions( navigation )
+        self.assertEqual( { "b": second }, state.key_regions )
+        self.assertTrue( state.contains( ( 20, 22 ) ) )
+
+    def test_searchWindow(self):
+        pattern = re.compile( r"\w=(\d)" )
+        search = lambda begin, end, complete: [ match.span( 1 ) for match in HighlightWords.search_window(
+                pattern, "a=1 b=2 c=3", 100, begin, end, complete, float( 'inf' ) ) ]
+
+        self.assertEqual( [ ( 102, 103 ) ], search( 100, 104, False ) )
+        self.assertEqual( [ ( 102, 103 ), ( 106, 107 ) ], search( 100, 200, False ) )
+        self.assertEqual( [ ( 102, 103 ), ( 106, 107 ), ( 110, 111 ) ], search( 100, 200, True ) )
+        self.assertEqual( [ ( 106, 107 ), ( 110, 111 ) ], search( 101, 200, True ) )
+
+    def test_chunkedSearch(self):
+        pattern = re.compile( r"(a)a*|(?=(b))" )
+        text = "aaa baa aaaaaa ab"
+        search = HighlightWords.ChunkedSearch( "/(a)a*|(?=(b))/", pattern )
+
+        # the visible chunk first, with the start of a match crossing into it
+        for index in [ 2, 0, 1, 3 ]:
+            begin, end = index * 5, min( len( text ), index * 5 + 5 )
+            search.chunks[index] = HighlightWords.search_window( pattern, text[begin:end + 6], begin, begin, end, end + 6 >= len( text ), float( 'inf' ) )
+
+        expected = [ match.span() for match in re.finditer( pattern, text ) ]
+        self.assertEqual( expected, [ match.span() for match in search.matches() ] )
+
+        command = HighlightWords.HighlightWordsCommand( TextView( "", 0 ) )
+        self.assertEqual( command.get_entries( [ search.matches() ] ), search.get_entries( command.get_entries ) )
+
+    def test_mergeQuery(self):
+        self.assertEqual( ( "a b c", "a b c d" ), HighlightWords.merge_query( "a b", "b c", "c d", False, False, False ) )
+        self.assertEqual( ( "/(x)y/ a", "/(x)y/ a b" ), HighlightWords.merge_query( "a", "/(x)y/", "b a", True, False, False ) )
+
+    def test_regionsHistogram(self):
+        regions = HighlightWords.Regions( [ ( 0, 1 ), ( 2, 3 ), ( 5, 6 ), ( 9, 10 ) ] )
+
+        self.assertEqual( [ 2, 1, 1 ], regions.histogram( 10, 3 ) )
+        self.assertEqual( [ 4 ], regions.histogram( 10, 1 ) )
+        self.assertEqual( [ 0, 0 ], HighlightWords.Regions().histogram( 10, 2 ) )
+
+    def test_windowRegions(self):
+        regions = HighlightWords.Regions( [ ( begin, begin + 2 ) for begin in range( 0, 30, 3 ) ] )
+        self.assertEqual( [ ( 6, 8 ), ( 9, 11 ) ], list( HighlightWords.get_window_regions( regions, ( 5, 12 ) ) ) )
+
+    def test_overlappingWords(self):
+        text = "abc abc valid foobar id foo"
+        words = [ "ab", "bc", "id", "valid", "foo", "foobar", "abc" ]
+
+        for flags, count in [ ( 0, len( words ) ), ( re.IGNORECASE, 3 ) ]:
+            matchers = HighlightWords.Matcher.create( [ ( word, re.compile( re.escape( word ), flags ) ) for word in words ] )
+
+            found = {}
+            for matcher in matchers:
+                terms = matcher.terms()
+
+                for begin, end, term in matcher.finditer( text ):
+                    found.setdefault( terms[term], [] ).append( ( begin, end ) )
+
+            for word in words:
+                self.assertEqual( [ match.span() for match in re.finditer( re.escape( word ), text ) ], found.get( word, [] ) )
+
+            self.assertEqual( count, len( matchers ) )
+
+    def test_joinLiterals(self):
+        text = "foobar foobaz food fo xfoo"
+        words = [ "foobar", "foobaz", "food", r"\bfo\b" ]
+        matcher = HighlightWords.Matcher( [ ( word, re.compile( word ) ) for word in words ] )
+        self.assertEqual( r"(?:\bfo\b|foo(?:ba(?:r|z)|d))", matcher.pattern.pattern )
+
+        found = [ ( begin, end, words[term] ) for begin, end, term in matcher.finditer( text ) ]
+        self.assertEqual( sorted( ( match.start(), match.end(), word ) for word in words for match in re.finditer( word, text ) ), found )
+
+    def test_scanChunks(self):
+        chunk_size, margin = HighlightWords.LAZY_CHUNK_SIZE, HighlightWords.INCREMENTAL_MARGIN
+        self.addCleanup( setattr, HighlightWords, 'LAZY_CHUNK_SIZE', chunk_size )
+        self.addCleanup( setattr, HighlightWords, 'INCREMENTAL_MARGIN', margin )
+
+        HighlightWords.LAZY_CHUNK_SIZE = 5
+        HighlightWords.INCREMENTAL_MARGIN = 4
+        words = [ "aa", "aba", "a a", "x[a ]*x" ]
+        matchers = [ HighlightWords.Matcher( [ ( word, re.compile( word ) ) ] ) for word in words ]
+
+        for text in [ " a baaaaba", "aaaaaaaaaaaaa", "ababababa a a a aaba", "ax aaaa a aaaaa aaxa x aaa aaaaaaa aaaaaax x" ]:
+            for visible in range( len( text ) ):
+                regions = list( HighlightWords.scan_chunks( TextView( text, visible ), matchers, lambda: False ) )[-1]
+
+                for word, word_regions in zip( words, regions ):
+                    self.assertEqual( [ match.span() for match in re.finditer( word, text ) ], list( word_regions ) )
+
+    def test_slowTermsSkipped(self):
+        budget = HighlightWords.REGEX_TIME_BUDGET
+        self.addCleanup( setattr, HighlightWords, 'REGEX_TIME_BUDGET', budget )
+
+        state = HighlightWords.Data( None )
+        state.update_text( "a ab a " * 100000 )
+        matcher = HighlightWords.Matcher( [ ( "a+b?", re.compile( "a+b?" ) ) ] )
+
+        # the budget was spent by the terms before it on the pass
+        HighlightWords.REGEX_TIME_BUDGET = 1.0
+        self.assertRaises( HighlightWords.TimeBudgetExceeded, state.find_regions, matcher, None, 0 )
+        self.assertNotIn( matcher.key, state.slow_keys )
+
+        HighlightWords.REGEX_TIME_BUDGET = 0.001
+        self.assertRaises( HighlightWords.TimeBudgetExceeded, state.find_regions, matcher )
+
+        HighlightWords.REGEX_TIME_BUDGET = 1.0
+        self.assertRaises( HighlightWords.TimeBudgetExceeded, state.find_regions, matcher )
+
+        state.retain_regions( [] )
+        self.assertEqual( 300000, len( state.find_regions( matcher ) ) )
+
+    def test_incrementalRescan(self):
+        margin = HighlightWords.INCREMENTAL_MARGIN
+        self.addCleanup( setattr, HighlightWords, 'INCREMENTAL_MARGIN', margin )
+        HighlightWords.INCREMENTAL_MARGIN = 8
+
+        text = "BEGIN" + " text\n" * 20 + "EN word"
+        new_text = text.replace( "EN", "END" )
+
+        for source in [ r"BEGIN[\s\S]*?END", "word", "text" ]:
+            matcher = HighlightWords.Matcher( [ ( source, re.compile( source ) ) ] )
+            state = HighlightWords.Data( None )
+
+            state.update_text( text )
+            state.find_regions( matcher )
+            state.update_text( new_text )
+            self.assertEqual( list( HighlightWords.Regions( matcher.finditer( new_text ) ) ), list( state.find_regions( matcher ) ) )
+
+    def test_diskResults(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup( shutil.rmtree, directory )
+
+        cache_size = HighlightWords.DISK_CACHE_SIZE
+        self.addCleanup( setattr, HighlightWords, 'DISK_CACHE_SIZE', cache_size )
+        HighlightWords.DISK_CACHE_SIZE = 2 ** 20
+
+        file_key = ( "file.txt", 1.0, 100 )
+        drawn = [ ( "HighlightWords_0", HighlightWords.Regions( [ ( 1, 3 ), ( 5, 8 ) ] ), "comment" ),
+                ( "HighlightWords_1", HighlightWords.Regions(), "string" ) ]
+
+        with unittest.mock.patch.object( HighlightWords.sublime, 'cache_path', return_value=directory ):
+            HighlightWords.save_disk_results( file_key, 'words', "foo", drawn )
+            loaded = HighlightWords.load_disk_results( file_key, 'words', "foo" )
+
+            self.assertEqual( [ ( key, list( regions ), scope ) for key, regions, scope in drawn ],
+                    [ ( key, list( regions ), scope ) for key, regions, scope in loaded ] )
+
+            key, path = HighlightWords.get_disk_cache_path( file_key, 'words', "foo" )
+            other_key, other_path = HighlightWords.get_disk_cache_path( file_key, 'words', "bar" )
+
+            with open( path, 'rb' ) as file:
+                data = file.read()
+
+            # a file stored for another key on the same path
+            with open( other_path, 'wb' ) as file:
+                file.write( data )
+
+            self.assertIsNone( HighlightWords.load_disk_results( file_key, 'words', "bar" ) )
+
+            itemsize = b'"itemsize": %d' % array.array( 'l' ).itemsize
+            for corrupt in [ data.replace( itemsize, itemsize[:-1] + b'0' ), data[:-array.array( 'l' ).itemsize], b'' ]:
+
+                with open( path, 'wb' ) as file:
+                    file.write( corrupt )
+
+                self.assertIsNone( HighlightWords.load_disk_results( file_key, 'words', "foo" ) )